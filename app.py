@@ -1,35 +1,36 @@
 # app.py
 from __future__ import annotations
 
+import functools
+import re
 from pathlib import Path
 from typing import Optional, List
 
 import gradio as gr
 
-from lib import run_once  # your updated run_once that accepts sort_by + sink kwargs
+from lib import parse_schema, run_once, start_warmup  # run_once accepts sort_by + sink kwargs
+
+
+_COLS_RE = re.compile(r"\s*,\s*")
 
 
 def _parse_cols(csv_text: str | None) -> list[str]:
     if not csv_text:
         return []
-    return [c.strip() for c in csv_text.split(",") if c.strip()]
+    return [c for c in _COLS_RE.split(csv_text.strip()) if c]
 
 
 def _parse_schema_json(text: str | None) -> Optional[list[str]]:
     """
-    Accepts a JSON array of field names (e.g., ["country","capital"]).
-    Returns None if empty.
+    Accepts a JSON array of field names (e.g., ["country","capital"]) or
+    {"fields": [...]}; names are stripped and duplicates dropped. Non-string
+    names are rejected. Returns None if empty.
     """
     if not text or not text.strip():
         return None
-    import json
-
     try:
-        data = json.loads(text)
-        if not isinstance(data, list) or not all(isinstance(x, str) for x in data):
-            raise ValueError("Schema JSON must be an array of strings.")
-        return [x.strip() for x in data]
-    except Exception as e:
+        return list(parse_schema(text, strict=True))
+    except ValueError as e:
         raise gr.Error(f"Invalid schema JSON: {e}") from e
 
 
@@ -52,7 +53,126 @@ def _status_for_sink(
     return f"CSV written to: {csv_out}"
 
 
+def on_generate(
+    prompt: str,
+    columns_csv: str,
+    rows: int | float,
+    sort_by: str | None,
+    schema_json: str | None,
+    sink: str,
+    csv_out: str,
+    db_path: str | None,
+    table: str | None,
+    replace_tbl: bool,
+    upsert_keys_text: str,
+    upsert_policy_val: str,
+    upsert_cols_text: str,
+    docx_path_val: str | None,
+    docx_title_val: str | None,
+    *,
+    default_csv: str = "out/data.csv",
+):
+    """Gradio handler for the Generate button (module-level, no closure state)."""
+    if not prompt or not str(prompt).strip():
+        raise gr.Error("Please provide a prompt.")
+    try:
+        n_rows = int(rows) if rows is not None else 20
+    except Exception:
+        n_rows = 20
+
+    schema_fields = _parse_schema_json(schema_json)
+
+    # small optim: pass schema through as columns, if no columns provided
+    # (the columns box is only parsed when it has content or there is no schema)
+    if schema_fields and not (columns_csv or "").strip():
+        columns = schema_fields[:]
+    else:
+        columns = _parse_cols(columns_csv) or (schema_fields or [])[:]
+
+    sort_by_val = (sort_by or "").strip() or None
+
+    # Build sink kwargs only when SQLite is selected (keeps CSV path authoritative)
+    sink_kwargs = {}
+    if sink == "sqlite":
+        # Start by parsing UPSERT keys
+        keys = [c.strip() for c in (upsert_keys_text or "").split(",") if c.strip()]
+        # Parse UPSERT policy
+        if upsert_policy_val == "all":
+            update_spec = "all"
+        elif upsert_policy_val == "none":
+            update_spec = "none"
+        else:
+            update_spec = [
+                c.strip() for c in (upsert_cols_text or "").split(",") if c.strip()
+            ]
+
+        sink_kwargs = {
+            "sink": "sqlite",
+            "sqlite_db": db_path or None,
+            "sqlite_table": table or None,
+            "sqlite_replace": bool(replace_tbl),
+            "sqlite_upsert_keys": keys or None,
+            "sqlite_upsert_update": update_spec,  # "all" | "none" | list[str]
+        }
+
+    if sink == "docx":
+        sink_kwargs = {
+            "sink": "docx",
+            "docx_path": docx_path_val or None,
+            "docx_title": docx_title_val or None,
+        }
+
+    # Delegate to lib.run_once (now with sort_by)
+    df, info = run_once(
+        prompt=prompt,
+        columns=columns,
+        row_count=n_rows,
+        sort_by=sort_by_val,
+        output=csv_out or default_csv,
+        schema_fields=schema_fields,
+        **sink_kwargs,
+    )
+
+    # Status message
+    msg_bits: List[str] = []
+    msg_bits.append(
+        _status_for_sink(
+            sink=sink,
+            csv_out=csv_out or default_csv,
+            sqlite_db=db_path,
+            sqlite_table=table,
+            row_count=len(df),
+        )
+    )
+    if sink == "sqlite" and (keys or upsert_policy_val != "all"):
+        msg_bits.append(
+            f"UPSERT → keys: {keys or '—'} | policy: {upsert_policy_val if upsert_policy_val != 'only listed columns' else upsert_cols_text}"
+        )
+
+    # Projection info (if present)
+    proj = (info or {}).get("projection")
+    if proj:
+        kept = proj.get("kept", [])
+        added = proj.get("added_empty", [])
+        dropped = proj.get("dropped", [])
+        msg_bits.append(
+            f"Projection → kept: {kept} | added(NULL): {added} | dropped: {dropped}"
+        )
+
+    # Return a 10-row preview for UX, as plain lists (skips the DataFrame serializer)
+    preview = df.head(10).fillna("")
+    headers = [str(c) for c in preview.columns]
+    return gr.update(visible=True, value="\n\n".join(msg_bits)), gr.update(
+        visible=True,
+        value={"headers": headers, "data": preview.values.tolist()},
+        headers=headers,
+    )
+
+
 def build_ui() -> gr.Blocks:
+    # Warm the pooled OpenAI connection while the user is still typing
+    start_warmup()
+
     with gr.Blocks(title="Prompt → Table (CSV / SQLite)") as demo:
         gr.Markdown("# Prompt → Table\nCSV by default; optionally persist to SQLite.")
 
@@ -174,120 +294,8 @@ def build_ui() -> gr.Blocks:
             outputs=[sqlite_upsert_cols_row],
         )
 
-        # Core handler
-        def on_generate(
-            prompt: str,
-            columns_csv: str,
-            rows: int | float,
-            sort_by: str | None,
-            schema_json: str | None,
-            sink: str,
-            csv_out: str,
-            db_path: str | None,
-            table: str | None,
-            replace_tbl: bool,
-            upsert_keys_text: str,
-            upsert_policy_val: str,
-            upsert_cols_text: str,
-            docx_path_val: str | None,
-            docx_title_val: str | None,
-        ):
-            if not prompt or not str(prompt).strip():
-                raise gr.Error("Please provide a prompt.")
-            try:
-                n_rows = int(rows) if rows is not None else 20
-            except Exception:
-                n_rows = 20
-
-            columns = _parse_cols(columns_csv)
-            schema_fields = _parse_schema_json(schema_json)
-
-            # small optim: pass schema through as columns, if no columns provided
-            if not columns and schema_fields:
-                columns = schema_fields[:]
-
-            sort_by_val = (sort_by or "").strip() or None
-
-            # Build sink kwargs only when SQLite is selected (keeps CSV path authoritative)
-            sink_kwargs = {}
-            if sink == "sqlite":
-                # Start by parsing UPSERT keys
-                keys = [
-                    c.strip() for c in (upsert_keys_text or "").split(",") if c.strip()
-                ]
-                # Parse UPSERT policy
-                if upsert_policy_val == "all":
-                    update_spec = "all"
-                elif upsert_policy_val == "none":
-                    update_spec = "none"
-                else:
-                    update_spec = [
-                        c.strip()
-                        for c in (upsert_cols_text or "").split(",")
-                        if c.strip()
-                    ]
-
-                sink_kwargs = {
-                    "sink": "sqlite",
-                    "sqlite_db": db_path or None,
-                    "sqlite_table": table or None,
-                    "sqlite_replace": bool(replace_tbl),
-                    "sqlite_upsert_keys": keys or None,
-                    "sqlite_upsert_update": update_spec,  # "all" | "none" | list[str]
-                }
-
-            if sink == "docx":
-                sink_kwargs = {
-                    "sink": "docx",
-                    "docx_path": docx_path_val or None,
-                    "docx_title": docx_title_val or None,
-                }
-
-            # Delegate to lib.run_once (now with sort_by)
-            df, info = run_once(
-                prompt=prompt,
-                columns=columns,
-                row_count=n_rows,
-                sort_by=sort_by_val,
-                output=csv_out or "out/data.csv",
-                schema_fields=schema_fields,
-                **sink_kwargs,
-            )
-
-            # Status message
-            msg_bits: List[str] = []
-            msg_bits.append(
-                _status_for_sink(
-                    sink=sink,
-                    csv_out=csv_out or "out/data.csv",
-                    sqlite_db=db_path,
-                    sqlite_table=table,
-                    row_count=len(df),
-                )
-            )
-            if sink == "sqlite" and (keys or upsert_policy_val != "all"):
-                msg_bits.append(
-                    f"UPSERT → keys: {keys or '—'} | policy: {upsert_policy_val if upsert_policy_val != 'only listed columns' else upsert_cols_text}"
-                )
-
-            # Projection info (if present)
-            proj = (info or {}).get("projection")
-            if proj:
-                kept = proj.get("kept", [])
-                added = proj.get("added_empty", [])
-                dropped = proj.get("dropped", [])
-                msg_bits.append(
-                    f"Projection → kept: {kept} | added(NULL): {added} | dropped: {dropped}"
-                )
-
-            # Return a 10-row preview for UX
-            preview = df.head(10)
-            return gr.update(visible=True, value="\n\n".join(msg_bits)), gr.update(
-                visible=True, value=preview
-            )
-
         gen_btn.click(
-            fn=on_generate,
+            fn=functools.partial(on_generate, default_csv="out/data.csv"),
             inputs=[
                 prompt_in,
                 cols_csv,
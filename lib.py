@@ -1,15 +1,66 @@
-from validator_csv import parse_and_validate
-from typing import List, Iterable, Optional, Dict, Any
+import asyncio
+import functools
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+try:
+    import orjson as _json  # C-accelerated; accepts str or bytes
+except ImportError:  # pragma: no cover - optional dependency
+    _json = json
+from validator_csv import (
+    extract_labeled_fences,
+    fast_repair,
+    parse_and_validate,
+    FenceStreamScanner,
+)
+from validator_json import parse_and_validate_json
+from typing import TYPE_CHECKING, List, Iterable, Iterator, Literal, Optional, Dict, Any, Sequence
 import pandas as pd
 
 from pathlib import Path
 
-from sinks import Sink, Row, CsvSink, SqliteSink, DocxSink
+from sinks import Sink, Row, CsvSink, SqliteSink, DocxSink, drop_table
+from local_datasets import lookup_local
+from llm_cache import LLMCache
+from throttle import ThrottledCaller
 
-from openai import OpenAI
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 RETRY_LIMIT = 2
+# Transport-level retries (429/5xx/timeouts/connection errors), done by the SDK
+# with jittered exponential backoff; separate from RETRY_LIMIT's correction turns
+API_MAX_RETRIES = 3
+
+MODEL = "gpt-4o-mini"  # good cost/latency for CSV emission
+
+# Decode budget: sized from the expected table, clamped to a safe ceiling
+DEFAULT_MAX_TOKENS = 1500  # when the table shape is unknown
+MAX_TOKENS_CAP = 4096
+BATCH_MAX_TOKENS_CAP = 16384  # gpt-4o-mini output limit; one call carries several tables
+# Batch API jobs (call_llm_batch): status polling backoff, in seconds
+BATCH_POLL_INITIAL = 5.0
+BATCH_POLL_MAX = 300.0
+TOKENS_PER_CELL = {"csv": 16, "json": 24}  # JSON repeats the key in every cell
+
+# run_once(speculative=True): first attempt races one greedy + sampled replies
+SPECULATIVE_SEEDS = (42, 43, 44)
+SPECULATIVE_TEMPERATURE = 0.3
+
+# LLM completions and validated outputs, keyed by a hash of the request (see llm_cache);
+# kept in the user cache dir so it survives cleaning out/ and is shared across checkouts
+RESULT_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "poc_llm_query_to_data"
+)
 
 CORRECTION_TEMPLATE = """Your previous output was invalid for these reasons:
 {errors}
@@ -22,128 +73,706 @@ Here is your previous output to fix, do NOT add explanations:
 {original}
 """
 
+JSON_CORRECTION_TEMPLATE = """Your previous output was invalid for these reasons:
+{errors}
+
+Re-emit the result as a single JSON object {{"rows": [...]}},
+with the specs previously provided. No commentary.
+Here is your previous output to fix, do NOT add explanations:
+
+{original}
+"""
+
+# Corrections quote only the ends of the previous reply and the first errors:
+# the model regenerates from the original prompt, so echoing a 1.5k-token
+# reply back in full just adds prompt tokens to every retry
+CORRECTION_EXCERPT_CHARS = 500
+CORRECTION_MAX_ERRORS = 20
+
+ReplyFormat = Literal["csv", "json"]
+
 # You need to set your OpenAI API key
 # export OPENAI_API_KEY=sk-...
 
-try:
-    _client = OpenAI()
-except Exception as e:
-    print(e)
+logger = logging.getLogger(__name__)
 
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]");
+# find_spec checks for it without paying for the import at startup
+_HTTP2 = importlib.util.find_spec("h2") is not None
 
-def build_system_prompt(headers: list[str], row_count: int | None = None) -> str:
-    lines = [
-        "You are a data emitter. Return ONLY valid CSV inside one single ```csv fenced block.",
-        f"Header MUST be exactly: {','.join(headers)}",
-        "Use RFC4180 quoting rules: quote fields that contain commas or quotes; escape quotes by doubling them.",
-    ]
-    if row_count is not None:
+# With pyarrow installed, string columns are stored as one Arrow buffer each
+# instead of a Python object per cell
+_STRING_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else None
+
+# Optional client-side rate limiting shared by every worker thread; off unless
+# OPENAI_RPM / OPENAI_TPM are set or set_rate_limits() is called
+_throttle: ThrottledCaller | None = None
+
+
+def set_rate_limits(rpm: int | None = None, tpm: int | None = None) -> None:
+    """Pace call_llm/stream_llm to rpm requests and tpm tokens per minute (None = unlimited)."""
+    global _throttle
+    _throttle = ThrottledCaller(rpm, tpm) if rpm or tpm else None
+
+
+def _env_limit(name: str) -> int | None:
+    """Positive integer from the environment; a malformed value is ignored with a warning."""
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        logger.warning("ignoring %s=%r: expected a whole number per minute", name, raw)
+        return None
+    return value if value > 0 else None
+
+
+set_rate_limits(_env_limit("OPENAI_RPM"), _env_limit("OPENAI_TPM"))
+
+
+def _wait_for_budget(messages: Sequence[dict], max_tokens: int) -> None:
+    if _throttle is not None:
+        # ~4 chars per prompt token plus the full decode budget, as OpenAI counts it
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        _throttle.acquire(prompt_chars // 4 + max_tokens)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client() -> "OpenAI":
+    """
+    Build the OpenAI client once and reuse it across calls, so warm workers keep
+    their TCP/TLS connections alive instead of re-handshaking on every request.
+    The SDK is imported here, on first use, to keep `import lib` cheap.
+    """
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        http2=_HTTP2,
+        # sized for run_many/run_batch fan-out, not just one request at a time
+        limits=httpx.Limits(
+            max_keepalive_connections=32, max_connections=64, keepalive_expiry=30
+        ),
+        timeout=60,
+    )
+    return OpenAI(http_client=http_client, max_retries=API_MAX_RETRIES)
+
+
+@functools.lru_cache(maxsize=256)
+def build_system_prompt(
+    headers: tuple[str, ...],
+    row_count: int | None = None,
+    fmt: ReplyFormat = "csv",
+    sort_by: str | None = None,
+) -> str:
+    if fmt == "json":
+        lines = [
+            'You are a data emitter. Return ONLY a JSON object of the form {"rows": [{...}, ...]}.',
+            f"Each row object MUST have exactly these keys: {', '.join(headers)}",
+        ]
+    else:
+        lines = [
+            "You are a data emitter. Return ONLY valid CSV inside one single ```csv fenced block.",
+            f"Header MUST be exactly: {','.join(headers)}",
+            "Use RFC4180 quoting rules: quote fields that contain commas or quotes; escape quotes by doubling them.",
+        ]
+    if row_count is not None and fmt == "json":
+        lines.append(f"Return exactly {row_count} row objects.")
+    elif row_count is not None:
         lines.append(
             f"Return exactly {row_count} data rows, in addition to the header row."
         )
+    if sort_by:
+        lines.append(f"Sort the rows A→Z by the '{sort_by}' column.")
 
     return "\n".join(lines)
 
 
-def call_llm(messages: list[dict]) -> str:
+def _prompt_cache_key(messages: Sequence[dict]) -> str:
+    """
+    Stable key derived from the system prompt, so retries (which resend the same
+    system + user prefix) are routed to the same OpenAI prompt cache.
+    """
+    return hashlib.sha256(messages[0]["content"].encode("utf-8")).hexdigest()[:32]
+
+
+def _max_tokens_for(
+    row_count: int | None, n_cols: int, fmt: ReplyFormat = "csv"
+) -> int:
+    """Decode budget for a `row_count` x `n_cols` table (+ header/fence overhead)."""
+    if not row_count or not n_cols:
+        return DEFAULT_MAX_TOKENS
+    return min(MAX_TOKENS_CAP, TOKENS_PER_CELL[fmt] * row_count * n_cols + 64)
+
+
+def _completion_body(messages: Sequence[dict], max_tokens: int) -> Dict[str, Any]:
+    """Request parameters that determine a non-streamed completion (also its cache key)."""
+    return {
+        "model": MODEL,
+        "messages": list(messages),
+        "temperature": 0,
+        "top_p": 1,
+        "max_tokens": max_tokens,
+        # "seed": 42,  # improves reproducibility across runs
+    }
+
+
+def call_llm(
+    messages: Sequence[dict],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    use_cache: bool = True,
+) -> str:
     """
     messages: [{"role": "system"|"user"|"assistant", "content": str}, ...]
     returns: assistant text (str)
+
+    Complete replies are cached (see llm_cache): at temperature=0 a
+    byte-identical request is answered locally instead of over the network.
+    """
+    body = _completion_body(messages, max_tokens)
+    key = LLMCache.key(kind="completion", **body) if use_cache else None
+    if key is not None and (cached := _llm_cache().get(key)) is not None:
+        return cached
+    _wait_for_budget(messages, max_tokens)
+    try:
+        resp = _get_client().chat.completions.create(
+            **body, prompt_cache_key=_prompt_cache_key(messages)
+        )
+    except Exception as e:
+        # Let the driver handle retries/logging
+        raise RuntimeError(f"OpenAI API error: {e}") from e
+    choice = resp.choices[0]
+    text = choice.message.content or ""
+    if key is not None and choice.finish_reason == "stop":
+        _llm_cache().set(key, text)  # truncated replies are not worth replaying
+    return text
+
+
+def call_llm_batch(
+    batch: Sequence[Sequence[dict]],
+    max_tokens: int | Sequence[int] = DEFAULT_MAX_TOKENS,
+    use_cache: bool = True,
+) -> list[str]:
+    """
+    Run several chat requests through the OpenAI Batch API: half the price of
+    real-time calls, but results may take up to the 24h completion window.
+    Blocks (polling with exponential backoff) until the job ends.
+
+    Cached requests are answered locally and only the misses are submitted.
+    Returns the assistant texts in input order; a request that failed inside
+    the batch comes back as "" so the caller's validation can fall back.
+    """
+    budgets = [max_tokens] * len(batch) if isinstance(max_tokens, int) else list(max_tokens)
+    bodies = [_completion_body(m, t) for m, t in zip(batch, budgets)]
+    keys = [LLMCache.key(kind="completion", **b) if use_cache else None for b in bodies]
+    replies = [(_llm_cache().get(k) if k else None) for k in keys]
+    todo = [i for i, r in enumerate(replies) if r is None]
+    if not todo:
+        return replies
+
+    jsonl = "".join(
+        json.dumps(
+            {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {**bodies[i], "prompt_cache_key": _prompt_cache_key(batch[i])},
+            },
+            ensure_ascii=False,
+        )
+        + "\n"
+        for i in todo
+    )
+    try:
+        client = _get_client()
+        upload = client.files.create(
+            file=("batch.jsonl", jsonl.encode("utf-8")), purpose="batch"
+        )
+        job = client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        delay = BATCH_POLL_INITIAL
+        while job.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(delay)
+            delay = min(2 * delay, BATCH_POLL_MAX)
+            job = client.batches.retrieve(job.id)
+        if job.status != "completed" or not job.output_file_id:
+            raise RuntimeError(f"batch {job.id} ended with status {job.status}")
+        output = client.files.content(job.output_file_id).text
+    except Exception as e:
+        raise RuntimeError(f"OpenAI API error: {e}") from e
+
+    for line in output.splitlines():
+        rec = json.loads(line)
+        i = int(rec["custom_id"])
+        choices = ((rec.get("response") or {}).get("body") or {}).get("choices") or []
+        if not choices:
+            continue
+        replies[i] = choices[0]["message"]["content"] or ""
+        if keys[i] is not None and choices[0].get("finish_reason") == "stop":
+            _llm_cache().set(keys[i], replies[i])
+    return [r or "" for r in replies]
+
+
+def stream_llm(
+    messages: Sequence[dict],
+    response_format: dict | None = None,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    temperature: float = 0,
+    seed: int | None = None,
+    finish: dict | None = None,
+) -> Iterator[str]:
+    """
+    Streaming variant of `call_llm`: yields the assistant text as it is generated.
+    Closing the generator early closes the underlying HTTP response.
+    If `finish` is given, finish["reason"] receives the final finish_reason
+    ("stop", "length", ...) once the stream reaches it.
     """
+    extra: Dict[str, Any] = {"response_format": response_format} if response_format else {}
+    if seed is not None:
+        extra["seed"] = seed
+    _wait_for_budget(messages, max_tokens)
     try:
-        resp = _client.chat.completions.create(
-            model="gpt-4o-mini",  # good cost/latency for CSV emission
+        stream = _get_client().chat.completions.create(
+            model=MODEL,
             messages=messages,
-            temperature=0,
+            temperature=temperature,
             top_p=1,
-            max_tokens=1500,
-            # seed=42,  # improves reproducibility across runs
+            max_tokens=max_tokens,
+            prompt_cache_key=_prompt_cache_key(messages),
+            stream=True,
+            **extra,
         )
-        return resp.choices[0].message.content or ""
+        with stream:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    yield choice.delta.content
+                if finish is not None and choice.finish_reason:
+                    finish["reason"] = choice.finish_reason
     except Exception as e:
-        # Let the driver handle retries/logging
-        raise RuntimeError(f"OpenAI API error: {e}")
+        raise RuntimeError(f"OpenAI API error: {e}") from e
+
+
+_warmup_lock = threading.Lock()
+_warmup_started = False
 
 
-def csv_rows_to_dicts(matrix: List[List[str]]) -> List[Row]:
+def _warmup() -> None:
+    messages = [{"role": "user", "content": "ping"}]
+    try:
+        _wait_for_budget(messages, 1)  # counts against OPENAI_RPM like any other call
+        _get_client().chat.completions.create(model=MODEL, messages=messages, max_tokens=1)
+    except Exception:
+        pass  # best effort: the real request will surface any error
+
+
+def start_warmup() -> None:
     """
-    Convert parsed CSV matrix (including header row) into list[dict].
-    Assumes header matches headers (already validated in your validator).
+    Pre-pay the TLS handshake and model routing of the first request with a tiny
+    completion on a background thread. Runs at most once per process.
     """
-    header = matrix[0]
-    rows = matrix[1:]
-    return [dict(zip(header, r)) for r in rows]
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=_warmup, name="openai-warmup", daemon=True).start()
+
 
+def _collect_reply(
+    messages: Sequence[dict],
+    headers: list[str],
+    fmt: ReplyFormat = "csv",
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    *,
+    temperature: float = 0,
+    seed: int | None = None,
+    stop: threading.Event | None = None,
+    use_cache: bool = True,
+    finish: dict | None = None,
+) -> str:
+    """
+    Consume the streamed reply, stopping as soon as the header or a row is known
+    to be wrong, or when `stop` is set (another speculative sample already won).
 
-def emit(rows: Iterable[Row], sink: Sink) -> None:
+    At temperature 0 complete replies go through the same completion cache as
+    `call_llm` (keyed on _completion_body, plus response_format/seed when set),
+    so a repeated request is answered without a network call. `finish` is
+    filled as in `stream_llm`.
+    """
+    finish = {} if finish is None else finish
+    # JSON mode: no fence/header to scan, the model is constrained server-side
+    response_format = {"type": "json_object"} if fmt == "json" else None
+    key = None
+    if use_cache and temperature == 0:
+        extra = {"response_format": response_format, "seed": seed}
+        key = LLMCache.key(
+            kind="completion",
+            **_completion_body(messages, max_tokens),
+            **{k: v for k, v in extra.items() if v is not None},
+        )
+        if (cached := _llm_cache().get(key)) is not None:
+            finish["reason"] = "stop"
+            return cached
+
+    scanner = FenceStreamScanner([] if fmt == "json" else headers)
+    deltas = stream_llm(
+        messages,
+        response_format=response_format,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        seed=seed,
+        finish=finish,
+    )
     try:
-        with sink:
+        for delta in deltas:
+            if scanner.feed(delta) or (stop is not None and stop.is_set()):
+                break
+    finally:
+        deltas.close()
+    if key is not None and finish.get("reason") == "stop":
+        _llm_cache().set(key, scanner.text)  # aborted or truncated replies are not replayed
+    return scanner.text
+
+
+def _check_reply(
+    reply: str,
+    headers: list[str],
+    row_count: int | None,
+    fmt: ReplyFormat,
+    sort_by: str | None = None,
+) -> tuple[list[str], List[List[str]], bool]:
+    """Validate a reply; returns (errors, data, repaired) with fast_repair applied to CSV."""
+    if fmt == "json":
+        errors, data = parse_and_validate_json(reply, headers, row_count)
+        return errors, data, False
+    errors, data = parse_and_validate(reply, headers, row_count, sort_by)
+    if errors and (repaired := fast_repair(reply, headers)) is not None:
+        # Cheap structural fixes first; only a real error costs an LLM retry
+        repaired_errors, repaired_data = parse_and_validate(
+            repaired, headers, row_count, sort_by
+        )
+        if not repaired_errors:
+            return repaired_errors, repaired_data, True
+    return errors, data, False
+
+
+def _speculate(
+    messages: Sequence[dict],
+    headers: list[str],
+    row_count: int | None,
+    fmt: ReplyFormat,
+    max_tokens: int,
+    sort_by: str | None = None,
+    use_cache: bool = True,
+    finish: dict | None = None,
+) -> tuple[str, list[str], List[List[str]], bool]:
+    """
+    Stream one reply per SPECULATIVE_SEEDS concurrently (the first greedy, the
+    rest sampled at SPECULATIVE_TEMPERATURE so they can differ) and return the
+    first that validates as (reply, errors, data, repaired); the others are
+    stopped. If none validates, the earliest finished failure is returned.
+    `finish` receives the returned sample's finish reason (see `stream_llm`).
+    """
+    stop = threading.Event()
+    first_failure = None
+    error: Exception | None = None
+    finishes = [{} for _ in SPECULATIVE_SEEDS]
+    # No `with`: its exit would wait for every losing stream before returning
+    pool = ThreadPoolExecutor(max_workers=len(SPECULATIVE_SEEDS))
+    try:
+        futures = [
+            pool.submit(
+                _collect_reply,
+                messages,
+                headers,
+                fmt,
+                max_tokens,
+                temperature=0 if i == 0 else SPECULATIVE_TEMPERATURE,
+                seed=seed,
+                stop=stop,
+                use_cache=use_cache,
+                finish=finishes[i],
+            )
+            for i, seed in enumerate(SPECULATIVE_SEEDS)
+        ]
+        sample_finish = dict(zip(futures, finishes))
+        for fut in as_completed(futures):
+            try:
+                reply = fut.result()
+            except Exception as e:  # one failed sample shouldn't sink the others
+                error = e
+                continue
+            errors, data, repaired = _check_reply(reply, headers, row_count, fmt, sort_by)
+            if not errors or first_failure is None:
+                if finish is not None:
+                    finish.update(sample_finish[fut])
+                if not errors:
+                    return reply, errors, data, repaired
+                first_failure = (reply, errors, data, repaired)
+    finally:
+        # Losers see `stop` at their next delta and wind down in the background
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+    if first_failure is None:
+        raise error  # every sample raised
+    return first_failure
+
+
+def matrix_to_df(
+    matrix: List[List[str]], columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Convert parsed CSV matrix (including header row) into a DataFrame in one go.
+    Assumes header matches headers (already validated in your validator).
+    `columns` overrides the header row's names (e.g. already-normalized ones).
+
+    The row-list constructor is kept on purpose: a column-wise build
+    (dict(zip(header, zip(*rows)))) measured ~3x slower for 10k string rows
+    and silently drops duplicate header names.
+    """
+    return pd.DataFrame(
+        matrix[1:], columns=columns or matrix[0], dtype=_STRING_DTYPE
+    )
+
+
+def _write_to(
+    rows: Iterable[Row] | pd.DataFrame, sink: Sink, positional: bool = False
+) -> None:
+    with sink:
+        if positional:
+            sink.write_rows(rows)
+        elif isinstance(rows, pd.DataFrame):
+            # Sinks with a bulk path (e.g. CsvSink.write_df) skip the records round-trip
+            if hasattr(sink, "write_df"):
+                sink.write_df(rows)
+            else:
+                sink.write(rows.to_dict(orient="records"))
+        else:
             sink.write(rows)
-        return f"Success: {type(sink)}"
-    except Exception as e:
-        return f"Failure: {e}"
 
 
-def emit_df(df, sink: Sink) -> None:
-    return emit(df.to_dict(orient="records"), sink)
+def emit(
+    rows: Iterable[Row] | pd.DataFrame,
+    sink: Sink | List[Sink],
+    positional: bool = False,
+) -> str:
+    """
+    Write rows to one sink, or to several sinks concurrently.
+
+    With positional=True, rows are sequences aligned to the sink columns and go
+    through `sink.write_rows` (CSV/SQLite sinks).
+
+    Sink writes are I/O-bound, so with several sinks each one is opened,
+    written and closed in its own thread (which also keeps SQLite connections
+    on the thread that created them). Returns one status per sink, joined by "; ".
+    """
+    if not isinstance(sink, (list, tuple)):
+        try:
+            _write_to(rows, sink, positional)
+            return f"Success: {type(sink)}"
+        except Exception as e:
+            return f"Failure: {e}"
+
+    if not isinstance(rows, pd.DataFrame):
+        rows = list(rows)  # materialize once: every sink consumes the same rows
+    with ThreadPoolExecutor(max_workers=max(len(sink), 1)) as pool:
+        futures = [pool.submit(_write_to, rows, s, positional) for s in sink]
+    statuses = []
+    for s, fut in zip(sink, futures):
+        exc = fut.exception()
+        statuses.append(f"Failure: {exc}" if exc else f"Success: {type(s)}")
+    return "; ".join(statuses)
+
+
+def emit_df(df, sink: Sink | List[Sink]) -> str:
+    return emit(df, sink)
 
 
 # -----------------------
-# Helpers for projection
+# Schema parsing (shared by the CLI and the Gradio app)
 # -----------------------
 
 
-def _normalize_df_headers(df: pd.DataFrame) -> pd.DataFrame:
-    """Trim whitespace on column names."""
-    df = df.copy()
-    df.columns = [c.strip() if isinstance(c, str) else c for c in df.columns]
-    return df
+@functools.lru_cache(maxsize=64)
+def parse_schema(raw: str | bytes, strict: bool = False) -> tuple[str, ...]:
+    """
+    Parse a schema given as a JSON array of field names or {"fields": [...]}.
+    Names are stripped and de-duplicated (first occurrence wins); non-string
+    names are coerced with str(), or rejected with strict=True. Cached by raw
+    text since the same schema is usually resubmitted. Raises ValueError on bad input.
+    """
+    data = _json.loads(raw)
+    if isinstance(data, dict):
+        data = data.get("fields")
+    if not isinstance(data, list):
+        raise ValueError('Schema must be a list or {"fields": [...]}.')
+    if strict and not all(isinstance(x, str) for x in data):
+        raise ValueError("Schema field names must be strings.")
+    return tuple(dict.fromkeys(str(x).strip() for x in data))
+
+
+# -----------------------
+# Helpers for projection
+# -----------------------
 
 
-def _project_dataframe(df: pd.DataFrame, target_fields: list[str]) -> pd.DataFrame:
+def _project_dataframe(
+    df: pd.DataFrame, target_fields: list[str]
+) -> tuple[pd.DataFrame, list[str], list[str]]:
     """
-    Return a frame with exactly target_fields in that order.
-    Missing fields are added with None; extra fields are dropped.
+    Return (frame, missing_fields, dropped_fields), where frame has exactly
+    target_fields in that order. Missing fields are added as NaN (nulls for
+    every sink); extra fields are dropped.
     """
-    df = df.copy()
     df_cols = set(df.columns)
-    data = {}
-    for f in target_fields:
-        if f in df_cols:
-            data[f] = df[f]
+    target = set(target_fields)
+    missing = [f for f in target_fields if f not in df_cols]
+    dropped = [c for c in df.columns if c not in target]
+    return df.reindex(columns=target_fields), missing, dropped
+
+
+def _records_for_sink(df: pd.DataFrame) -> Iterator[dict]:
+    """
+    Lazily yield row dicts for sinks without a positional path (DOCX), with
+    nulls (NaN/None/NA) as "" (empty string).
+
+    Rows are built one at a time so the DataFrame is never duplicated as a
+    full list of dicts.
+    """
+    cols = list(df.columns)
+    # Mask nulls column-wise on object ndarrays: one vectorized isna per
+    # column instead of a Python test per cell
+    arrays = []
+    for i in range(len(cols)):
+        a = df.iloc[:, i].to_numpy(dtype=object, copy=True)
+        a[pd.isna(a)] = ""
+        arrays.append(a)
+    for t in zip(*arrays):
+        yield dict(zip(cols, t))
+
+
+def _build_sink(
+    sink_kind: str, output: str, target_fields: list[str], sink_kwargs: Dict[str, Any]
+) -> Sink:
+    """Instantiate the sink selected through `run_once(**sink_kwargs)`."""
+    if sink_kind == "sqlite":
+        db_path = sink_kwargs.get("sqlite_db") or str(Path(output).with_suffix(".sqlite"))
+        table = sink_kwargs.get("sqlite_table") or (Path(output).stem or "data")
+        replace = bool(sink_kwargs.get("sqlite_replace", False))
+        return SqliteSink(
+            db_path,
+            table,
+            columns=target_fields,
+            replace_table=replace,
+            upsert_keys=sink_kwargs.get("sqlite_upsert_keys"),
+            upsert_update=sink_kwargs.get("sqlite_upsert_update"),
+            shared=bool(sink_kwargs.get("sqlite_shared", False)),
+        )
+    if sink_kind == "docx":
+        docx_path = sink_kwargs.get("docx_path") or str(Path(output).with_suffix(".docx"))
+        docx_title = sink_kwargs.get("docx_title") or "Generated Data"
+        return DocxSink(path=docx_path, headers=target_fields, title=docx_title)
+    return CsvSink(path=output, headers=target_fields)
+
+
+def _persist(
+    data: List[List[str]],
+    effective_cols: list[str],
+    sink: Sink | None,
+    sink_kind: str,
+    output: str,
+    sink_kwargs: Dict[str, Any],
+    info: Dict[str, Any],
+) -> pd.DataFrame:
+    """
+    Turn a validated CSV matrix into the projected DataFrame and persist it.
+    Raises RuntimeError if the sink fails.
+    """
+    header = [c.strip() for c in data[0]] if data else []
+    # Decide target fields *consistently* (columns > schema > produced)
+    target_fields = effective_cols or header
+
+    target_set = set(target_fields)
+    if sink_kind in ("csv", "sqlite") and target_set <= set(header):
+        # Fast path: every target field is present, so the validated rows go
+        # straight to sink.write_rows as-is (or re-ordered); pandas is only
+        # needed when a target field is missing and has to be filled
+        if header == target_fields:
+            rows = data[1:]
         else:
-            data[f] = pd.Series([None] * len(df), index=df.index)
-    return pd.DataFrame(data, index=df.index)
-
-
-def _projection_report(
-    df_before: pd.DataFrame, df_after: pd.DataFrame, target_fields: list[str]
-) -> Dict[str, Any]:
-    before_cols = [str(c) for c in df_before.columns]
-    after_cols = [str(c) for c in df_after.columns]
-    kept = [c for c in after_cols if c in before_cols]
-    added_empty = [c for c in after_cols if c not in before_cols]
-    dropped = [c for c in before_cols if c not in after_cols]
-    return {
+            idx = [header.index(f) for f in target_fields]
+            rows = [[r[i] for i in idx] for r in data[1:]]
+        df_proj = pd.DataFrame(rows, columns=target_fields, dtype=_STRING_DTYPE)
+        missing, dropped = [], [c for c in header if c not in target_set]
+        rows_to_emit, positional = rows, True
+    else:
+        # LLM CSV matrix -> DF directly (no list-of-dicts intermediate), named
+        # with the already-stripped header so no rename/copy pass is needed
+        df_raw = matrix_to_df(data, columns=header)
+
+        # Project
+        df_proj, missing, dropped = _project_dataframe(df_raw, target_fields)
+
+        # CSV/SQLite take the frame in bulk (positional rows); DOCX gets records
+        rows_to_emit = (
+            df_proj
+            if sink_kind in ("csv", "sqlite")
+            else _records_for_sink(df_proj)
+        )
+        positional = False
+
+    missing_set = set(missing)
+    info["projection"] = {
         "target": target_fields,
-        "kept": kept,
-        "added_empty": added_empty,
+        "kept": [f for f in target_fields if f not in missing_set],
+        "added_empty": missing,
         "dropped": dropped,
-        "missing_fields": added_empty,
+        "missing_fields": missing,
         "dropped_fields": dropped,
     }
 
+    # Persist via selected sink
+    if sink is None:
+        sink = _build_sink(sink_kind, output, target_fields, sink_kwargs)
 
-def _records_for_sink(df: pd.DataFrame, sink_kind: str) -> list[dict]:
-    """
-    Convert to list-of-dicts with proper null handling:
-      - CSV: NaN -> "" (empty string)
-      - SQLite: NaN -> None
-    """
-    if sink_kind == "sqlite":
-        return df.where(pd.notna(df), None).to_dict(orient="records")
-    # CSV (also fine for DOCX)
-    return df.where(pd.notna(df), "").to_dict(orient="records")
+    print("Ready to persist data received from LLM")
+    status = emit(rows_to_emit, sink, positional)
+    print(status)
+
+    if "Failure" in status:
+        raise RuntimeError("Error while persisting the data")
+    return df_proj
+
+
+# -----------------------
+# Result cache
+# -----------------------
+
+
+@functools.lru_cache(maxsize=4)
+def _cache_at(path: Path) -> LLMCache:
+    return LLMCache(path)
+
+
+def _llm_cache() -> LLMCache:
+    """The shared completion/result store under RESULT_CACHE_DIR."""
+    return _cache_at(RESULT_CACHE_DIR / "cache.sqlite")
+
+
+def _read_cached_matrix(key: str) -> Optional[List[List[str]]]:
+    text = _llm_cache().get(key)
+    return None if text is None else json.loads(text)
+
+
+def _write_cached_matrix(key: str, matrix: List[List[str]]) -> None:
+    _llm_cache().set(key, json.dumps(matrix, ensure_ascii=False))
 
 
 # -----------------------
@@ -157,12 +786,22 @@ def run_once(
     row_count: int | None = None,
     output: str = "out/data.csv",
     schema_fields: Optional[list[str]] = None,
+    use_cache: bool = True,
+    reply_format: ReplyFormat = "csv",
+    sort_by: str | None = None,
+    speculative: bool = False,
     **sink_kwargs,
-):
+) -> tuple[pd.DataFrame, Dict[str, Any]]:
     """
     Updated flow:
-      1) Get LLM reply, validate, convert to dict rows.
-      2) Build DataFrame directly from dict_rows (no CSV round-trip).
+      0) Reuse the validated output of an identical earlier request (unless use_cache=False),
+         or answer from a bundled table (local_datasets) when the prompt is covered.
+      1) Get LLM reply (CSV, or JSON mode with reply_format="json") and validate it.
+         With speculative=True the first attempt races several samples and keeps
+         the first valid one (costs up to len(SPECULATIVE_SEEDS)x the tokens).
+         A reply cut off at max_tokens is re-requested with twice the budget
+         (up to MAX_TOKENS_CAP) instead of a correction turn.
+      2) Build DataFrame directly from the validated matrix (no CSV round-trip).
       3) Normalize headers and project to target fields (columns > schema_fields > produced).
       4) Persist via the selected sink (CSV default, SQLite optional) with sink-appropriate null handling.
       5) Return (df, info)
@@ -171,11 +810,16 @@ def run_once(
     info: Dict[str, Any] = {}
     df: pd.DataFrame | None = None
 
-    system_prompt = build_system_prompt(columns, row_count)
-    messages = [
+    system_prompt = build_system_prompt(
+        tuple(columns or ()), row_count, reply_format, sort_by
+    )
+    # Fixed prefix, built once and resent byte-identical on every attempt
+    # (prompt-cache friendly); a tuple so no attempt can mutate it
+    base_messages = (
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt},
-    ]
+    )
+    messages = base_messages
 
     # Normalize explicit columns (may be empty if user left it blank in the UX)
     explicit_cols = [c.strip() for c in (columns or []) if str(c).strip()]
@@ -184,69 +828,260 @@ def run_once(
     # Use schema when columns are empty
     effective_cols = explicit_cols or schema_cols
 
-    for attempt in range(RETRY_LIMIT + 1):
-        reply = call_llm(messages)
-        errors, data = parse_and_validate(reply, effective_cols, row_count)
-        if not errors:
-            # 1) LLM CSV text -> dict rows
-            dict_rows = csv_rows_to_dicts(data)
+    # Build the sink once, up front, whenever the target fields are already known
+    sink_kind = sink_kwargs.get("sink", "csv")
+    sink: Sink | None = (
+        _build_sink(sink_kind, output, effective_cols, sink_kwargs)
+        if effective_cols
+        else None
+    )
 
-            # 2) Build DF directly
-            df_raw = pd.DataFrame(dict_rows)
-            df_raw = _normalize_df_headers(df_raw)
-
-            # Decide target fields *consistently* (columns > schema > produced)
-            target_fields = effective_cols or list(df_raw.columns)
+    # Keyed on the exact messages sent (system prompt covers columns,
+    # row_count, sort_by and reply format), so prompt edits invalidate it
+    cache_key = (
+        LLMCache.key(
+            kind="result", model=MODEL, messages=base_messages, schema_fields=schema_cols
+        )
+        if use_cache
+        else None
+    )
+    data = _read_cached_matrix(cache_key) if cache_key else None
+    if data is not None:
+        info["cache"] = "hit"
+        df = _persist(data, effective_cols, sink, sink_kind, output, sink_kwargs, info)
+        return df.reset_index(drop=True), info
 
-            # 3) Project
-            df_proj = _project_dataframe(df_raw, target_fields)
-            info["projection"] = _projection_report(df_raw, df_proj, target_fields)
+    # Well-known tables are answered from bundled data, without an LLM call
+    local = lookup_local(prompt, effective_cols, row_count, sort_by)
+    if local is not None:
+        info["source"] = "local"
+        df = _persist(local, effective_cols, sink, sink_kind, output, sink_kwargs, info)
+        return df.reset_index(drop=True), info
 
-            # 4) Persist via selected sink
-            sink_kind = sink_kwargs.get("sink", "csv")
-            if sink_kind == "sqlite":
-                db_path = sink_kwargs.get("sqlite_db") or str(
-                    Path(output).with_suffix(".sqlite")
-                )
-                table = sink_kwargs.get("sqlite_table") or (Path(output).stem or "data")
-                replace = bool(sink_kwargs.get("sqlite_replace", False))
-                sink = SqliteSink(
-                    db_path,
-                    table,
-                    columns=target_fields,
-                    replace_table=replace,
-                    upsert_keys=sink_kwargs.get("sqlite_upsert_keys"),
-                    upsert_update=sink_kwargs.get("sqlite_upsert_update"),
-                )
-            elif sink_kind == "docx":
-                docx_path = sink_kwargs.get("docx_path") or str(Path(output).with_suffix(".docx"))
-                docx_title = sink_kwargs.get("docx_title") or "Generated Data"
-                sink = DocxSink(path=docx_path, headers=target_fields, title=docx_title)
-            else:
-                sink = CsvSink(path=output, headers=target_fields)
-
-            rows_to_emit = _records_for_sink(df_proj, sink_kind)
-            print("Ready to persist data received from LLM")
-            status = emit(rows_to_emit, sink)
-            print(status)
+    max_tokens = _max_tokens_for(row_count, len(effective_cols), reply_format)
+    for attempt in range(RETRY_LIMIT + 1):
+        finish: Dict[str, str] = {}
+        if attempt == 0 and speculative:
+            reply, errors, data, repaired = _speculate(
+                messages,
+                effective_cols,
+                row_count,
+                reply_format,
+                max_tokens,
+                sort_by,
+                use_cache=use_cache,
+                finish=finish,
+            )
+        else:
+            reply = _collect_reply(
+                messages,
+                effective_cols,
+                reply_format,
+                max_tokens,
+                use_cache=use_cache,
+                finish=finish,
+            )
+            errors, data, repaired = _check_reply(
+                reply, effective_cols, row_count, reply_format, sort_by
+            )
+        if repaired:
+            info["repaired"] = True
+        if not errors:
+            df = _persist(data, effective_cols, sink, sink_kind, output, sink_kwargs, info)
+            if cache_key is not None:
+                _write_cached_matrix(cache_key, data)
+            success = True
+            break
 
-            if "Success" in status:
-                success = True
-                df = df_proj
-                break
-            elif "Failure" in status:
-                raise RuntimeError("Error while persisting the data")
+        if finish.get("reason") == "length" and max_tokens < MAX_TOKENS_CAP:
+            # Cut off by the decode budget, not wrong: the same request with
+            # more room beats a correction that would be truncated again
+            max_tokens = min(2 * max_tokens, MAX_TOKENS_CAP)
+            messages = base_messages
+            continue
 
         # retry with correction
-        correction = CORRECTION_TEMPLATE.format(
-            errors="\n".join(f"- {e}" for e in errors),
-            original=reply,
+        template = JSON_CORRECTION_TEMPLATE if reply_format == "json" else CORRECTION_TEMPLATE
+        correction = template.format(
+            errors=_error_list(errors), original=_excerpt(reply)
         )
-        messages.append({"role": "assistant", "content": reply})
-        messages.append({"role": "user", "content": correction})
+        # Stateless retry: fixed prefix + a single correction turn (no growing history)
+        messages = (*base_messages, {"role": "user", "content": correction})
 
     if not success or df is None:
         raise RuntimeError(f"Validation failed after {RETRY_LIMIT + 1} attempts.")
 
     # Return projected DF (already persisted) + info for logs
     return df.reset_index(drop=True), info
+
+
+def _excerpt(text: str, n: int = CORRECTION_EXCERPT_CHARS) -> str:
+    """First and last n characters of text, with the middle elided."""
+    if len(text) <= 2 * n:
+        return text
+    return f"{text[:n]}\n[... {len(text) - 2 * n} characters omitted ...]\n{text[-n:]}"
+
+
+def _error_list(errors: list[str], limit: int = CORRECTION_MAX_ERRORS) -> str:
+    lines = [f"- {e}" for e in errors[:limit]]
+    if len(errors) > limit:
+        lines.append(f"- ... and {len(errors) - limit} more")
+    return "\n".join(lines)
+
+
+def _indexed_output(output: str, i: int) -> str:
+    p = Path(output)
+    return str(p.with_name(f"{p.stem}_{i}{p.suffix}"))
+
+
+async def run_many(
+    prompts: list[str],
+    columns: list[str],
+    row_count: int | None = None,
+    output: str = "out/data.csv",
+    concurrency: int = 4,
+    **kwargs,
+) -> list[tuple[pd.DataFrame, Dict[str, Any]]]:
+    """
+    Run `run_once` for several prompts concurrently, results in prompt order.
+
+    At most `concurrency` runs are in flight (keeps us under the OpenAI RPM limit).
+    Prompt i (1-based) is written to `<stem>_<i><suffix>` of `output`; explicit sink
+    paths passed in kwargs (e.g. docx_path) are shared by every run.
+    Each run executes in a worker thread on the pooled client, so N prompts take
+    ~max(latency) instead of sum(latency).
+    With sink="sqlite", an explicit sqlite_db + sqlite_table is one table shared by
+    every run: sqlite_replace then drops it once up front instead of in each run,
+    which would discard the rows of runs that finished earlier.
+    """
+    if (
+        kwargs.get("sink") == "sqlite"
+        and kwargs.get("sqlite_replace")
+        and kwargs.get("sqlite_db")
+        and kwargs.get("sqlite_table")
+    ):
+        drop_table(kwargs["sqlite_db"], kwargs["sqlite_table"])
+        kwargs = {**kwargs, "sqlite_replace": False}
+    sem = asyncio.Semaphore(max(concurrency, 1))
+
+    async def _one(i: int, prompt: str) -> tuple[pd.DataFrame, Dict[str, Any]]:
+        async with sem:
+            return await asyncio.to_thread(
+                run_once, prompt, columns, row_count, _indexed_output(output, i), **kwargs
+            )
+
+    return list(
+        await asyncio.gather(*(_one(i, p) for i, p in enumerate(prompts, start=1)))
+    )
+
+
+# -----------------------
+# Batch prompting
+# -----------------------
+
+
+@dataclass(frozen=True)
+class BatchItem:
+    """One sub-request of a batched LLM call."""
+
+    prompt: str
+    columns: tuple[str, ...]
+    row_count: int | None = None
+    output: str = "out/data.csv"
+
+
+@functools.lru_cache(maxsize=128)
+def build_batch_system_prompt(
+    items: tuple[BatchItem, ...], sort_by: str | None = None
+) -> str:
+    lines = [
+        f"You are a data emitter. You will receive {len(items)} numbered requests (#1..#{len(items)}).",
+        f"Return ONLY {len(items)} ```csv fenced blocks, in order, each opened with ```csv #<n> on its own line.",
+        "Use RFC4180 quoting rules: quote fields that contain commas or quotes; escape quotes by doubling them.",
+    ]
+    for n, item in enumerate(items, start=1):
+        line = f"#{n}: Header MUST be exactly: {','.join(item.columns)}."
+        if item.row_count is not None:
+            line += f" Return exactly {item.row_count} data rows, in addition to the header row."
+        lines.append(line)
+    if sort_by:
+        lines.append(f"Within each block, sort the rows A→Z by the '{sort_by}' column.")
+    return "\n".join(lines)
+
+
+def run_batch(
+    items: list[BatchItem],
+    batch_size: int = 5,
+    use_batch_api: bool = False,
+    **kwargs,
+) -> list[tuple[pd.DataFrame, Dict[str, Any]]]:
+    """
+    Generate several tables with one LLM call per `batch_size` items.
+
+    Fewer, larger calls amortize per-request overhead; past a few items the
+    reply gets long and error-prone, so tune `batch_size` for the workload.
+    With use_batch_api=True every group goes into one OpenAI Batch API job
+    (half price, but may take hours; see call_llm_batch) instead of real-time calls.
+    Each block is checked like a `run_once` reply (sort order and fast_repair
+    included); items whose block still fails fall back to `run_once` (with its
+    correction retries). kwargs are passed through as in `run_once`;
+    reply_format="json" has no batch form, so those items go to `run_once` directly.
+    Returns one (df, info) pair per item, in order.
+    """
+    if kwargs.get("reply_format", "csv") == "json":
+        return [
+            run_once(it.prompt, list(it.columns), it.row_count, it.output, **kwargs)
+            for it in items
+        ]
+    sink_kind = kwargs.get("sink", "csv")
+    use_cache = kwargs.get("use_cache", True)
+    sort_by = kwargs.get("sort_by")
+    step = max(batch_size, 1)
+    groups = [tuple(items[start : start + step]) for start in range(0, len(items), step)]
+    requests = [
+        (
+            [
+                {"role": "system", "content": build_batch_system_prompt(group, sort_by)},
+                {
+                    "role": "user",
+                    "content": "\n".join(f"#{n}: {it.prompt}" for n, it in enumerate(group, start=1)),
+                },
+            ],
+            min(
+                BATCH_MAX_TOKENS_CAP,
+                sum(_max_tokens_for(it.row_count, len(it.columns)) for it in group),
+            ),
+        )
+        for group in groups
+    ]
+    if use_batch_api:
+        replies = call_llm_batch(
+            [m for m, _ in requests], [t for _, t in requests], use_cache=use_cache
+        )
+    else:
+        replies = [
+            call_llm(messages, max_tokens=max_tokens, use_cache=use_cache)
+            for messages, max_tokens in requests
+        ]
+
+    results: list[tuple[pd.DataFrame, Dict[str, Any]]] = []
+    for group, reply in zip(groups, replies):
+        blocks = extract_labeled_fences(reply)
+        for n, item in enumerate(group, start=1):
+            columns = list(item.columns)
+            errors, data, repaired = (
+                _check_reply(blocks[n], columns, item.row_count, "csv", sort_by)
+                if n in blocks
+                else ([f"missing block #{n}"], [], False)
+            )
+            if errors:
+                results.append(
+                    run_once(item.prompt, columns, item.row_count, item.output, **kwargs)
+                )
+                continue
+            info: Dict[str, Any] = {"batch": True}
+            if repaired:
+                info["repaired"] = True
+            df = _persist(data, columns, None, sink_kind, item.output, kwargs, info)
+            results.append((df.reset_index(drop=True), info))
+    return results
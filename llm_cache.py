@@ -0,0 +1,67 @@
+"""
+Content-addressed store for LLM outputs, backed by a single SQLite file.
+
+`lib` keeps two kinds of entries in it: raw completions from `call_llm`, and
+validated result matrices from `run_once`. Both are keyed by a hash of
+everything that determines the output (model, exact messages, decode
+settings), so identical requests skip the network round-trip. Entries older
+than `ttl` seconds are treated as missing.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+
+
+class LLMCache:
+    def __init__(self, path: str | os.PathLike, ttl: float = DEFAULT_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call: safe from run_many's worker threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def key(**request: Any) -> str:
+        """Stable hash of the request; dict order does not matter."""
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT response FROM cache WHERE key = ? AND ts >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def set(self, key: str, response: str) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, response, ts) VALUES (?, ?, ?)",
+                    (key, response, time.time()),
+                )
+        finally:
+            conn.close()
@@ -0,0 +1,88 @@
+"""
+Small bundled reference tables.
+
+`run_once` asks `lookup_local` before calling the LLM: prompts that are plain
+enumerations of a table we already ship are answered from memory instead of a
+multi-second network round-trip.
+"""
+
+import re
+from typing import List, Optional
+
+# EU member states and their capitals, sorted A→Z by country
+EU_CAPITALS: tuple[tuple[str, str], ...] = (
+    ("Austria", "Vienna"),
+    ("Belgium", "Brussels"),
+    ("Bulgaria", "Sofia"),
+    ("Croatia", "Zagreb"),
+    ("Cyprus", "Nicosia"),
+    ("Czechia", "Prague"),
+    ("Denmark", "Copenhagen"),
+    ("Estonia", "Tallinn"),
+    ("Finland", "Helsinki"),
+    ("France", "Paris"),
+    ("Germany", "Berlin"),
+    ("Greece", "Athens"),
+    ("Hungary", "Budapest"),
+    ("Ireland", "Dublin"),
+    ("Italy", "Rome"),
+    ("Latvia", "Riga"),
+    ("Lithuania", "Vilnius"),
+    ("Luxembourg", "Luxembourg"),
+    ("Malta", "Valletta"),
+    ("Netherlands", "Amsterdam"),
+    ("Poland", "Warsaw"),
+    ("Portugal", "Lisbon"),
+    ("Romania", "Bucharest"),
+    ("Slovakia", "Bratislava"),
+    ("Slovenia", "Ljubljana"),
+    ("Spain", "Madrid"),
+    ("Sweden", "Stockholm"),
+)
+_EU_COLUMNS = ("country", "capital")
+
+# The whole prompt must be a plain enumeration, e.g. "List 20 EU countries and
+# their capitals" or "Give me all the European Union member states". Anything
+# that narrows or changes the set ("non-EU", "candidate countries", "most
+# populous", ...) goes to the LLM. "EU" is matched case-sensitively so the
+# Portuguese "eu" does not qualify. A count in the prompt is captured as "n".
+_EU_CAPITALS_PROMPT = re.compile(
+    r"\s*(?i:list|give\s+me)\s+(?:(?P<n>\d+)\s+|(?i:all)\s+)?(?i:the\s+)?"
+    r"(?:EU|(?i:European\s+Union))\s+(?i:countries|member\s+states)"
+    r"(?:\s+(?i:and\s+(?:their\s+)?capitals?))?\s*\.?\s*"
+)
+
+
+def lookup_local(
+    prompt: str,
+    columns: list[str],
+    row_count: int | None = None,
+    sort_by: str | None = None,
+) -> Optional[List[List[str]]]:
+    """
+    Return a CSV matrix (header + rows) when the prompt is covered by a bundled
+    table, else None. Only exact column subsets of the table qualify.
+
+    A count in the prompt ("List 20 EU countries") caps the rows when
+    `row_count` is not given; if both are given and disagree, the request is
+    ambiguous and goes to the LLM.
+    """
+    if not columns or not set(columns) <= set(_EU_COLUMNS):
+        return None
+    match = _EU_CAPITALS_PROMPT.fullmatch(prompt or "")
+    if not match:
+        return None
+    if match["n"] is not None:
+        if row_count is not None and row_count != int(match["n"]):
+            return None
+        row_count = int(match["n"])
+    if row_count is not None and row_count > len(EU_CAPITALS):
+        return None
+
+    records = [dict(zip(_EU_COLUMNS, r)) for r in EU_CAPITALS]
+    if sort_by and sort_by in columns:
+        # Same case-insensitive order the validator checks sort_by against
+        records.sort(key=lambda r: r[sort_by].casefold())
+    if row_count is not None:
+        records = records[:row_count]
+    return [list(columns), *([r[c] for c in columns] for r in records)]
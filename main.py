@@ -1,10 +1,9 @@
 from pathlib import Path
+import asyncio
 import json
 import typer
 from typing import Literal, Optional
 
-from lib import run_once
-
 
 def _parse_schema(
     schema_json: Optional[str], schema_file: Optional[Path]
@@ -13,24 +12,14 @@ def _parse_schema(
         return None
     if schema_json and schema_file:
         raise typer.BadParameter("Use only one of --schema-json or --schema-file.")
-    raw = (
-        json.loads(Path(schema_file).read_text("utf-8"))
-        if schema_file
-        else json.loads(schema_json)
-    )
-    if isinstance(raw, list):
-        fields = [str(x) for x in raw]
-    elif isinstance(raw, dict) and isinstance(raw.get("fields"), list):
-        fields = [str(x) for x in raw["fields"]]
-    else:
-        raise typer.BadParameter('Schema must be a list or {"fields": [...]}.')
+    from lib import parse_schema
 
-    seen, uniq = set(), []
-    for f in fields:
-        if f not in seen:
-            seen.add(f)
-            uniq.append(f)
-    return uniq
+    try:
+        return list(
+            parse_schema(Path(schema_file).read_bytes() if schema_file else schema_json)
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
 
 
 def _normalize_for_json(v):
@@ -44,12 +33,14 @@ def _normalize_for_json(v):
 app = typer.Typer(help="LLM → Structured Data — CLI")
 
 OutputFormat = Literal["csv", "sqlite", "docx"]
+ReplyFormat = Literal["csv", "json"]
 
 
 @app.command("run")
 def cli_run(
-    prompt: str = typer.Argument(
-        ..., help="User prompt for gathering/generating data."
+    prompts: list[str] = typer.Argument(
+        ...,
+        help="User prompt(s) for gathering/generating data. Several prompts run concurrently.",
     ),
     columns: list[str] = typer.Option(
         None, "--col", help="Name of column to use for the tabular data."
@@ -64,6 +55,9 @@ def cli_run(
     format: OutputFormat = typer.Option(
         "csv", "--format", "-f", help="Output format (csv by default)."
     ),
+    reply_format: ReplyFormat = typer.Option(
+        "csv", "--reply-format", help="Ask the LLM for CSV (default) or JSON mode."
+    ),
     schema_json: Optional[str] = typer.Option(None, "--schema-json"),
     schema_file: Optional[Path] = typer.Option(None, "--schema-file"),
     sqlite_db: Optional[Path] = typer.Option(
@@ -90,23 +84,36 @@ def cli_run(
     docx_path: Optional[Path] = typer.Option(None, "--docx-path", help="Destination .docx (defaults to output with .docx)"),
     docx_title: Optional[str] = typer.Option(None, "--docx-title", help="Title/heading in the DOCX"),
     # Other
+    concurrency: int = typer.Option(
+        4, "--concurrency", help="Max prompts in flight when several are given."
+    ),
+    no_cache: bool = typer.Option(
+        False, "--no-cache", help="Ignore cached results and always call the LLM."
+    ),
+    speculative: bool = typer.Option(
+        False,
+        "--speculative",
+        help="Race several samples on the first attempt and keep the first valid one (more tokens, fewer retries).",
+    ),
     debug: bool = typer.Option(
         False, "--debug", help="Print parsed options/values for debugging"
     ),
 ) -> None:
     """
     Calls the existing run_once() using the provided prompt and writes raw CSV to --output.
+    With several prompts, run_many() runs them concurrently and prompt i writes to <output stem>_<i>.
     Example: python main.py "Produce the list of countries and their capitals." --col "country" --col "capital" --sort-by "country" --rows 25
     """
     # ---- DEBUG DUMP (before any transformations) ----
     if debug:
         raw_params = {
-            "prompt": prompt,
+            "prompts": prompts,
             "columns": columns,  # Typer gives a tuple when multiple=True
             "output": output,
             "row_count": row_count,
             "sort_by": sort_by,
             "format": format,
+            "reply_format": reply_format,
             "schema_json": schema_json,
             "schema_file": schema_file,
             "sqlite_db": sqlite_db,
@@ -116,10 +123,16 @@ def cli_run(
             "sqlite_upsert_update": sqlite_upsert_update,
             "docx_path": docx_path,
             "docx_title": docx_title,
+            "concurrency": concurrency,
+            "no_cache": no_cache,
+            "speculative": speculative,
         }
         normalized = {k: _normalize_for_json(v) for k, v in raw_params.items()}
         typer.echo("[DEBUG] CLI params:\n" + json.dumps(normalized, indent=2))
 
+    # Imported here so --help and argument errors don't pay for pandas/openai
+    from lib import run_once, run_many
+
     schema_fields = _parse_schema(schema_json, schema_file)
 
     # columns = generator hint; if no columns but we do have a schema, use schema as hint
@@ -129,7 +142,7 @@ def cli_run(
         sort_by = columns_hint[0]
 
     msg = (
-        f"▶ Running with prompt: {prompt!r} - Output details: {format}, {columns_hint}"
+        f"▶ Running with prompt(s): {prompts!r} - Output details: {format}, {columns_hint}"
     )
     if sort_by == columns_hint[0]:
         msg = f"{msg}, we will sort by 1st column"
@@ -165,21 +178,43 @@ def cli_run(
             "docx_title": docx_title,
         }
 
+    run_kwargs = dict(
+        schema_fields=schema_fields,
+        sort_by=sort_by,
+        use_cache=not no_cache,
+        speculative=speculative,
+        reply_format=reply_format,
+        **sink_kwargs,
+    )
     try:
-        df, status = run_once(
-            prompt,
-            columns=columns_hint,
-            row_count=row_count,
-            output=output,
-            schema_fields=schema_fields,
-            **sink_kwargs,
-        )
+        if len(prompts) == 1:
+            results = [
+                run_once(
+                    prompts[0],
+                    columns=columns_hint,
+                    row_count=row_count,
+                    output=output,
+                    **run_kwargs,
+                )
+            ]
+        else:
+            results = asyncio.run(
+                run_many(
+                    prompts,
+                    columns_hint,
+                    row_count,
+                    output=str(output),
+                    concurrency=concurrency,
+                    **run_kwargs,
+                )
+            )
     except Exception as e:
         typer.echo(f"❌ Generation failed: {e}", err=True)
         raise typer.Exit(code=2)
 
-    typer.echo(f"OUTPUT ✅: {status}")
-    typer.echo(df.head())
+    for df, info in results:
+        typer.echo(f"OUTPUT ✅: {info}")
+        typer.echo(df.head())
 
 
 if __name__ == "__main__":
@@ -7,20 +7,40 @@ from typing import (
     Literal,
     Self,
     Union,
-    runtime_checkable,
     Optional,
     Mapping,
+    Sequence,
     Any,
+    Iterator,
 )
+import atexit
 import csv
 import sqlite3
 import os
+import threading
+import weakref
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
 Row = Dict[str, Any]  # e.g., {"country": "...", "capital": "..."}
+# Positional row aligned to the sink's columns, e.g. ("France", "Paris")
+RowTuple = Sequence[Any]
+
+# 1 MiB block buffer: far fewer write() syscalls than the 8 KiB default
+CSV_BUFFER_SIZE = 1 << 20
+CSV_CHUNK_ROWS = 1000  # rows handed to writerows() at a time
+
+# High-throughput settings applied by SqliteSink(tuning=True). synchronous=NORMAL
+# is only set together with WAL, where it stays crash-safe.
+SQLITE_TUNING_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 MiB page cache
+    "PRAGMA mmap_size=268435456",  # 256 MiB memory-mapped I/O
+)
 
 
-@runtime_checkable
 class Sink(Protocol):
     """A minimal streaming writer interface used by the app."""
 
@@ -59,7 +79,8 @@ class CsvSink(SinkCM):
         headers: Column order to write. Extra keys in rows are ignored; missing keys become empty.
         newline: Line terminator to use when writing.
         encoding: File encoding (defaults to utf-8).
-        append: If True, append to file and only write header if file did not exist.
+        append: If True, append to file and only write header if file did not exist or was empty.
+        buffering: File buffer size in bytes (default 1 MiB); close() flushes it.
     """
 
     def __init__(
@@ -69,33 +90,60 @@ class CsvSink(SinkCM):
         newline: str = "\n",
         encoding: str = "utf-8",
         append: bool = False,
+        buffering: int = CSV_BUFFER_SIZE,
     ):
         self.path = path
         self.headers = headers
         self.newline = newline
         self.encoding = encoding
         self.append = append
+        self.buffering = buffering
         self._fh: Optional[Any] = None
-        self._writer: Optional[csv.DictWriter] = None
+        self._writer: Optional[Any] = None  # csv.writer
 
     def open(self) -> None:
-        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
-        mode = "a" if self.append else "w"
-        file_existed = Path(self.path).exists()
-        self._fh = open(self.path, mode, newline="", encoding=self.encoding)
-        self._writer = csv.DictWriter(
-            self._fh, fieldnames=self.headers, lineterminator=self.newline
+        p = Path(self.path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = p.open(
+            "a" if self.append else "w",
+            newline="",
+            encoding=self.encoding,
+            buffering=self.buffering,
         )
-        # Write header on create or when not appending
-        if not self.append or not file_existed:
-            self._writer.writeheader()
+        # Plain csv.writer: rows are aligned to headers here, not per row by DictWriter
+        self._writer = csv.writer(self._fh, lineterminator=self.newline)
+        # Header on a fresh file; in append mode the handle is positioned at EOF,
+        # so tell() == 0 means new/empty without a separate exists() stat
+        if not self.append or self._fh.tell() == 0:
+            self._writer.writerow(self.headers)
 
     def write(self, rows: Iterable[Row]) -> None:
         assert self._writer is not None, "CsvSink not opened"
-        for r in rows:
-            # normalize to declared headers only
-            safe = {h: r.get(h, "") for h in self.headers}
-            self._writer.writerow(safe)
+        headers = self.headers
+        it = iter(rows)
+        # normalize to declared headers only, one writerows() call per chunk
+        while chunk := [
+            [r.get(h, "") for h in headers] for r in islice(it, CSV_CHUNK_ROWS)
+        ]:
+            self._writer.writerows(chunk)
+
+    def write_rows(self, rows: Iterable[RowTuple]) -> None:
+        """Write positional rows already aligned to `headers` (no per-row dict lookups)."""
+        assert self._writer is not None, "CsvSink not opened"
+        it = iter(rows)
+        while chunk := list(islice(it, CSV_CHUNK_ROWS)):
+            self._writer.writerows(chunk)
+
+    def write_df(self, df: Any) -> None:
+        """Bulk-write a pandas DataFrame (NaN/None become empty fields)."""
+        assert self._fh is not None, "CsvSink not opened"
+        df.reindex(columns=self.headers).to_csv(
+            self._fh,
+            header=False,
+            index=False,
+            lineterminator=self.newline,
+            chunksize=10 * CSV_CHUNK_ROWS,
+        )
 
     def close(self) -> None:
         if self._fh is not None:
@@ -109,6 +157,7 @@ class CsvSink(SinkCM):
 # ----------------------------
 
 
+@lru_cache(maxsize=4096)  # bounded by distinct identifiers seen
 def _qident(name: str) -> str:
     """Quote an identifier for SQLite with double quotes.
     Very small helper; does not allow embedded quotes to avoid SQLi on identifiers.
@@ -118,6 +167,87 @@ def _qident(name: str) -> str:
     return f'"{name}"'
 
 
+@lru_cache(maxsize=64)
+def _insert_sql(
+    table: str,
+    columns: tuple[str, ...],
+    upsert_keys: tuple[str, ...] | None,
+    update_cols: tuple[str, ...],
+) -> str:
+    """
+    INSERT (or UPSERT) statement for a table layout. Memoized, so sinks that
+    reopen the same layout (e.g. run_many writing one table per prompt) skip
+    rebuilding the string; each sink already reused its one statement text.
+    """
+    placeholders = ", ".join("?" * len(columns))
+    cols_list = ", ".join(_qident(c) for c in columns)
+    sql = f"INSERT INTO {_qident(table)} ({cols_list}) VALUES ({placeholders})"
+    if not upsert_keys:
+        return sql
+    conflict = ", ".join(_qident(k) for k in upsert_keys)
+    if not update_cols:
+        return f"{sql} ON CONFLICT({conflict}) DO NOTHING"
+    set_clause = ", ".join(f"{_qident(c)}=excluded.{_qident(c)}" for c in update_cols)
+    return f"{sql} ON CONFLICT({conflict}) DO UPDATE SET {set_clause}"
+
+
+# Connections reused by SqliteSink(shared=True): each thread has its own pool
+# (threading.local), dropped -- and its connections closed -- when the thread
+# exits, so short-lived workers such as emit()'s leave nothing behind.
+class _ThreadPool:
+    def __init__(self) -> None:
+        self.conns: Dict[str, sqlite3.Connection] = {}
+
+    def __del__(self) -> None:
+        for conn in self.conns.values():
+            conn.close()
+
+
+_POOL_LOCAL = threading.local()
+_POOLS: "weakref.WeakSet[_ThreadPool]" = weakref.WeakSet()  # live pools, for shutdown()
+_POOL_LOCK = threading.Lock()
+
+
+def _pooled_connection(db_path: str) -> tuple[sqlite3.Connection, bool]:
+    """The calling thread's pooled connection to db_path, and whether it was just created."""
+    path = db_path if db_path == ":memory:" else os.path.abspath(db_path)
+    with _POOL_LOCK:
+        pool = getattr(_POOL_LOCAL, "pool", None)
+        if pool is None:
+            pool = _POOL_LOCAL.pool = _ThreadPool()
+            _POOLS.add(pool)
+        conn = pool.conns.get(path)
+        if conn is not None:
+            return conn, False
+        # check_same_thread=False only so shutdown() or thread teardown can close it
+        conn = pool.conns[path] = sqlite3.connect(
+            db_path, isolation_level=None, check_same_thread=False
+        )
+        return conn, True
+
+
+def shutdown() -> None:
+    """Close every pooled SQLite connection (registered with atexit)."""
+    with _POOL_LOCK:
+        conns = [conn for pool in _POOLS for conn in pool.conns.values()]
+        for pool in _POOLS:
+            pool.conns.clear()
+    for conn in conns:
+        conn.close()
+
+
+atexit.register(shutdown)
+
+
+def drop_table(db_path: str, table: str) -> None:
+    """DROP TABLE IF EXISTS on its own short-lived connection."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {_qident(table)}")
+    finally:
+        conn.close()
+
+
 class SqliteSink(SinkCM):
     """Write rows into a SQLite table, creating it if needed.
 
@@ -130,7 +260,14 @@ class SqliteSink(SinkCM):
         if_not_exists: Use CREATE TABLE IF NOT EXISTS.
         replace_table: If True, DROP TABLE IF EXISTS before creating it (overrides if_not_exists behavior).
         journal_wal: If True, set PRAGMA journal_mode=WAL for better concurrent reads.
-        batch_size: Number of rows to buffer before executing `executemany`.
+        batch_size: Rows handed to each `executemany` call.
+        tuning: If True, apply SQLITE_TUNING_PRAGMAS (and synchronous=NORMAL under WAL);
+                False keeps SQLite's defaults.
+        shared: If True, reuse this thread's pooled connection to `db_path` instead of
+                connecting per open; close() commits but leaves it open until the thread
+                exits or `shutdown` runs.
+                Connection PRAGMAs come from the sink that created it. A sink opened
+                while another shared sink's session is still open joins that transaction.
         ...
 
     Notes:
@@ -151,6 +288,8 @@ class SqliteSink(SinkCM):
         batch_size: int = 500,
         upsert_keys: Optional[List[str]] = None,
         upsert_update: Union[List[str], Literal["all", "none"]] = "all",
+        tuning: bool = True,
+        shared: bool = False,
     ):
         if schema is None and columns is None:
             raise ValueError("Provide at least one of `columns` or `schema`.")
@@ -167,8 +306,11 @@ class SqliteSink(SinkCM):
         self.replace_table = replace_table
         self.journal_wal = journal_wal
         self.batch_size = batch_size
+        self.tuning = tuning
+        self.shared = shared
+        self._owns_txn = False
         self._conn: Optional[sqlite3.Connection] = None
-        self._pending: List[List[Any]] = []
+        self._cols: tuple[str, ...] = tuple(columns)
         # upsert config
         self.upsert_keys = list(upsert_keys) if upsert_keys else None
         self.upsert_update = upsert_update
@@ -180,13 +322,14 @@ class SqliteSink(SinkCM):
     # context manager sugar provided by Sink protocol defaults
 
     def open(self) -> None:
-        self._conn = sqlite3.connect(self.db_path)
-        self._conn.execute("PRAGMA foreign_keys = ON")
-        if self.journal_wal:
-            try:
-                self._conn.execute("PRAGMA journal_mode=WAL")
-            except sqlite3.DatabaseError:
-                pass
+        # Transactions are managed explicitly: one for the whole sink session
+        if self.shared:
+            self._conn, fresh = _pooled_connection(self.db_path)
+        else:
+            self._conn = sqlite3.connect(self.db_path, isolation_level=None)
+            fresh = True
+        if fresh:
+            self._configure()
 
         cur = self._conn.cursor()
         if self.replace_table:
@@ -195,7 +338,6 @@ class SqliteSink(SinkCM):
         cols_sql = ", ".join([f"{_qident(k)} {v}" for k, v in self.schema.items()])
         ine = "IF NOT EXISTS " if self.if_not_exists and not self.replace_table else ""
         cur.execute(f"CREATE TABLE {ine}{_qident(self.table)} ({cols_sql})")
-        self._conn.commit()
 
         # Ensure UNIQUE index for upserts
         if self.upsert_keys:
@@ -205,58 +347,100 @@ class SqliteSink(SinkCM):
                 + ", ".join(_qident(k) for k in self.upsert_keys)
                 + ")"
             )
-            self._conn.commit()
 
-        placeholders = ", ".join(["?" for _ in self.columns])
-        cols_list = ", ".join([_qident(c) for c in self.columns])
-        if not self.upsert_keys:
-            self._insert_sql = f"INSERT INTO {_qident(self.table)} ({cols_list}) VALUES ({placeholders})"
+        non_keys = [c for c in self.columns if c not in (self.upsert_keys or ())]
+        if isinstance(self.upsert_update, list):
+            update_cols = [c for c in self.upsert_update if c in non_keys]
+        elif self.upsert_update == "all":
+            update_cols = non_keys
         else:
-            non_keys = [c for c in self.columns if c not in self.upsert_keys]
-            if isinstance(self.upsert_update, list):
-                update_cols = [c for c in self.upsert_update if c in non_keys]
-            elif self.upsert_update == "all":
-                update_cols = non_keys
-            else:
-                update_cols = []
-            conflict = ", ".join(_qident(k) for k in self.upsert_keys)
-            if update_cols:
-                set_clause = ", ".join(
-                    f"{_qident(c)}=excluded.{_qident(c)}" for c in update_cols
-                )
-                self._insert_sql = (
-                    f"INSERT INTO {_qident(self.table)} ({cols_list}) VALUES ({placeholders}) "
-                    f"ON CONFLICT({conflict}) DO UPDATE SET {set_clause}"
-                )
-            else:
-                self._insert_sql = (
-                    f"INSERT INTO {_qident(self.table)} ({cols_list}) VALUES ({placeholders}) "
-                    f"ON CONFLICT({conflict}) DO NOTHING"
-                )
-
-    def _flush(self) -> None:
-        if not self._pending:
-            return
-        assert self._conn is not None
-        self._conn.executemany(self._insert_sql, self._pending)
-        self._conn.commit()
-        self._pending.clear()
+            update_cols = []
+        self._insert_sql = _insert_sql(
+            self.table,
+            self._cols,
+            tuple(self.upsert_keys) if self.upsert_keys else None,
+            tuple(update_cols),
+        )
+
+        # Every write() until close() lands in this one transaction: a single
+        # commit (and fsync) per session instead of one per batch. IMMEDIATE
+        # takes the write lock up front instead of upgrading later. A shared
+        # connection may already be inside another sink's session: join it.
+        self._owns_txn = not self._conn.in_transaction
+        if self._owns_txn:
+            self._conn.execute("BEGIN IMMEDIATE")
+
+    def _configure(self) -> None:
+        """Per-connection PRAGMAs, applied once when the connection is created."""
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        if self.journal_wal:
+            try:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                if self.tuning:
+                    # WAL is durable enough with NORMAL sync: one fsync per checkpoint, not per commit
+                    self._conn.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.DatabaseError:
+                pass
+        if self.tuning:
+            for pragma in SQLITE_TUNING_PRAGMAS:
+                self._conn.execute(pragma)
+
+    @contextmanager
+    def _savepoint(self) -> Iterator[None]:
+        # Savepoint per call: a failed write is undone on its own, earlier ones stay
+        self._conn.execute("SAVEPOINT sink_write")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK TO sink_write")
+            raise
+        finally:
+            self._conn.execute("RELEASE sink_write")
 
     def write(self, rows: Iterable[Row]) -> None:
         assert self._conn is not None, "SqliteSink not opened"
-        for r in rows:
-            params = [r.get(col, None) for col in self.columns]
-            self._pending.append(params)
-            if len(self._pending) >= self.batch_size:
-                self._flush()
+        cols, it = self._cols, iter(rows)
+        with self._savepoint():
+            while chunk := list(islice(it, self.batch_size)):
+                # Gather column by column, then zip back into parameter tuples:
+                # one comprehension per column instead of a fresh list per row
+                columns = [[r.get(c) for r in chunk] for c in cols]
+                self._conn.executemany(self._insert_sql, zip(*columns))
+
+    def write_rows(self, rows: Iterable[RowTuple]) -> None:
+        """Write positional rows already aligned to `columns`; executemany takes them as-is."""
+        assert self._conn is not None, "SqliteSink not opened"
+        it = iter(rows)
+        with self._savepoint():
+            while chunk := list(islice(it, self.batch_size)):
+                self._conn.executemany(self._insert_sql, chunk)
+
+    def write_df(self, df: Any) -> None:
+        """Bulk-write a pandas DataFrame; missing columns and NaN are stored as NULL."""
+        frame = df.reindex(columns=self.columns)
+        self.write_rows(frame.itertuples(index=False, name=None))
 
     def close(self) -> None:
+        """Commit the session transaction (rolled back if that fails)."""
+        if self._conn is None:
+            return
         try:
-            self._flush()
+            if self._owns_txn:
+                self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
         finally:
-            if self._conn is not None:
+            if not self.shared:
                 self._conn.close()
-                self._conn = None
+            self._conn = None
+
+    def __exit__(self, exc_type, exc, tb):  # type: ignore[override]
+        # An exception escaping the `with` block discards the whole session
+        # (a sink that joined another's session leaves that decision to its owner)
+        if exc_type is not None and self._conn is not None and self._owns_txn:
+            self._conn.rollback()
+        return super().__exit__(exc_type, exc, tb)
 
 
 class NullSink(SinkCM):
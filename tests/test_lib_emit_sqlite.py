@@ -22,3 +22,36 @@ def test_emit_sqlite_creates_table_and_inserts(tmp_path):
         cur = con.cursor()
         cur.execute("SELECT country, capital FROM countries ORDER BY country")
         assert cur.fetchall() == [("France", "Paris"), ("Spain", None)]
+
+
+def test_emit_fans_out_to_several_sinks(tmp_path):
+    from lib import emit
+    from sinks import CsvSink
+
+    rows = iter([{"country": "France", "capital": "Paris"}])
+    status = emit(
+        rows,
+        [
+            CsvSink(str(tmp_path / "a.csv"), headers=["country", "capital"]),
+            SqliteSink(
+                tmp_path / "a.sqlite", "countries", columns=["country", "capital"]
+            ),
+        ],
+    )
+    assert status.count("Success") == 2
+
+    assert (tmp_path / "a.csv").read_text().splitlines() == [
+        "country,capital",
+        "France,Paris",
+    ]
+    with sqlite3.connect(tmp_path / "a.sqlite") as con:
+        assert con.execute("SELECT * FROM countries").fetchall() == [
+            ("France", "Paris")
+        ]
+
+
+def test_records_for_sink_null_handling():
+    from lib import _records_for_sink
+
+    df = pd.DataFrame({"country": ["Spain"], "capital": [float("nan")]})
+    assert list(_records_for_sink(df)) == [{"country": "Spain", "capital": ""}]
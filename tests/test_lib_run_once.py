@@ -0,0 +1,485 @@
+import csv
+
+import pytest
+
+import lib
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    d = tmp_path / "cache"
+    monkeypatch.setattr(lib, "RESULT_CACHE_DIR", d)
+    return d
+
+
+def fake_llm(monkeypatch, replies):
+    calls = []
+
+    def _collect(messages, *args, **kwargs):
+        calls.append(messages)
+        return replies[len(calls) - 1]
+
+    monkeypatch.setattr(lib, "_collect_reply", _collect)
+    return calls
+
+
+def test_run_once_writes_csv_and_reuses_cache(tmp_path, cache_dir, monkeypatch):
+    calls = fake_llm(monkeypatch, ["```csv\ncountry,capital\nFrance,Paris\n```"])
+    out = tmp_path / "out.csv"
+
+    df, info = lib.run_once("p", ["country", "capital"], 1, output=str(out))
+    assert df.to_dict(orient="records") == [{"country": "France", "capital": "Paris"}]
+    assert len(calls) == 1
+
+    out.unlink()
+    df2, info2 = lib.run_once("p", ["country", "capital"], 1, output=str(out))
+    assert len(calls) == 1  # served from the result cache
+    assert info2["cache"] == "hit"
+    assert df2.equals(df)
+    with open(out, newline="") as f:
+        assert list(csv.reader(f)) == [["country", "capital"], ["France", "Paris"]]
+
+
+def test_result_cache_is_keyed_on_the_prompt_sent(tmp_path, cache_dir, monkeypatch):
+    reply = "```csv\ncountry,capital\nFrance,Paris\n```"
+    calls = fake_llm(monkeypatch, [reply, reply])
+    out = str(tmp_path / "k.csv")
+    lib.run_once("p", ["country", "capital"], 1, output=out)
+    _, info = lib.run_once(
+        "p", ["country", "capital"], 1, output=out, sort_by="capital"
+    )
+    assert len(calls) == 2 and "cache" not in info
+
+
+def test_run_once_repairs_near_misses_without_a_retry(tmp_path, cache_dir, monkeypatch):
+    calls = fake_llm(monkeypatch, ["```csv\ncountry , capital\n\nFrance,Paris\n```"])
+    df, info = lib.run_once(
+        "p", ["country", "capital"], 1, output=str(tmp_path / "r.csv")
+    )
+    assert len(calls) == 1 and info["repaired"] is True
+    assert df.to_dict(orient="records") == [{"country": "France", "capital": "Paris"}]
+
+
+def test_run_once_serves_bundled_table_without_llm(tmp_path, cache_dir, monkeypatch):
+    calls = fake_llm(monkeypatch, [])
+    df, info = lib.run_once(
+        "List 3 EU countries and their capitals",
+        ["country", "capital"],
+        3,
+        output=str(tmp_path / "eu.csv"),
+    )
+    assert calls == []
+    assert info["source"] == "local"
+    assert list(df["country"]) == ["Austria", "Belgium", "Bulgaria"]
+
+
+def test_run_once_json_mode_retries_with_json_correction(
+    tmp_path, cache_dir, monkeypatch
+):
+    calls = fake_llm(
+        monkeypatch,
+        [
+            '{"rows": [{"country": "France"}]}',
+            '{"rows": [{"country": "France", "capital": "Paris"}]}',
+        ],
+    )
+    df, _ = lib.run_once(
+        "p",
+        ["country", "capital"],
+        1,
+        output=str(tmp_path / "j.csv"),
+        reply_format="json",
+    )
+    assert len(calls) == 2
+    assert '{"rows": [...]}' in calls[1][-1]["content"]
+    assert df.to_dict(orient="records") == [{"country": "France", "capital": "Paris"}]
+
+
+def test_correction_quotes_only_the_ends_of_a_long_reply(
+    tmp_path, cache_dir, monkeypatch
+):
+    bad = "```csv\nwrong\n" + "x\n" * 2000 + "```"
+    calls = fake_llm(monkeypatch, [bad, "```csv\ncountry,capital\nFrance,Paris\n```"])
+    lib.run_once("p", ["country", "capital"], 1, output=str(tmp_path / "c.csv"))
+    correction = calls[1][-1]["content"]
+    assert len(calls[1]) == 3  # fixed prefix + one correction turn
+    assert "characters omitted" in correction
+    assert len(correction) < 2 * lib.CORRECTION_EXCERPT_CHARS + 1000
+
+
+def test_max_tokens_scales_with_table_and_is_clamped():
+    assert lib._max_tokens_for(None, 2) == lib.DEFAULT_MAX_TOKENS
+    assert lib._max_tokens_for(20, 2) == 16 * 20 * 2 + 64
+    assert lib._max_tokens_for(20, 2, "json") > lib._max_tokens_for(20, 2)
+    assert lib._max_tokens_for(10_000, 10) == lib.MAX_TOKENS_CAP
+
+
+def test_run_many_runs_each_prompt_to_its_own_output(tmp_path, cache_dir, monkeypatch):
+    import asyncio
+
+    def _collect(messages, *args, **kwargs):
+        country = messages[1]["content"]
+        return f"```csv\ncountry,capital\n{country},x\n```"
+
+    monkeypatch.setattr(lib, "_collect_reply", _collect)
+    results = asyncio.run(
+        lib.run_many(
+            ["France", "Spain"],
+            ["country", "capital"],
+            1,
+            output=str(tmp_path / "d.csv"),
+        )
+    )
+    assert [df.loc[0, "country"] for df, _ in results] == ["France", "Spain"]
+    assert (tmp_path / "d_1.csv").exists() and (tmp_path / "d_2.csv").exists()
+
+
+def test_run_many_replaces_a_shared_sqlite_table_once(tmp_path, cache_dir, monkeypatch):
+    import asyncio
+    import sqlite3
+
+    db = str(tmp_path / "d.sqlite")
+    with sqlite3.connect(db) as conn:
+        conn.execute('CREATE TABLE "t" ("country" TEXT, "capital" TEXT)')
+        conn.execute("INSERT INTO t VALUES ('stale', 'row')")
+    conn.close()
+
+    def _collect(messages, *args, **kwargs):
+        country = messages[1]["content"]
+        return f"```csv\ncountry,capital\n{country},x\n```"
+
+    monkeypatch.setattr(lib, "_collect_reply", _collect)
+    asyncio.run(
+        lib.run_many(
+            ["France", "Spain"],
+            ["country", "capital"],
+            1,
+            output=str(tmp_path / "d.csv"),
+            concurrency=1,
+            sink="sqlite",
+            sqlite_db=db,
+            sqlite_table="t",
+            sqlite_replace=True,
+        )
+    )
+    conn = sqlite3.connect(db)
+    rows = conn.execute("SELECT country FROM t ORDER BY country").fetchall()
+    conn.close()
+    assert rows == [("France",), ("Spain",)]
+
+
+def test_run_batch_uses_one_call_and_falls_back_per_item(
+    tmp_path, cache_dir, monkeypatch
+):
+    batch_calls = []
+
+    def _call_llm(messages, **kwargs):
+        batch_calls.append(messages)
+        return "```csv #1\ncountry,capital\nFrance,Paris\n```\n```csv #2\nwrong\n```"
+
+    monkeypatch.setattr(lib, "call_llm", _call_llm)
+    fallback = fake_llm(monkeypatch, ["```csv\ncity\nRome\n```"])
+
+    items = [
+        lib.BatchItem("p1", ("country", "capital"), 1, str(tmp_path / "a.csv")),
+        lib.BatchItem("p2", ("city",), 1, str(tmp_path / "b.csv")),
+    ]
+    (df1, info1), (df2, info2) = lib.run_batch(items)
+    assert len(batch_calls) == 1 and len(fallback) == 1
+    assert info1["batch"] is True and "batch" not in info2
+    assert df1.loc[0, "capital"] == "Paris" and df2.loc[0, "city"] == "Rome"
+
+
+def test_run_batch_honours_sort_by_and_json(tmp_path, cache_dir, monkeypatch):
+    batch_calls = []
+
+    def _call_llm(messages, **kwargs):
+        batch_calls.append(messages)
+        return "```csv #1\ncountry,capital\nSpain,Madrid\nFrance,Paris\n```"
+
+    monkeypatch.setattr(lib, "call_llm", _call_llm)
+    fallback = fake_llm(
+        monkeypatch,
+        [
+            "```csv\ncountry,capital\nFrance,Paris\nSpain,Madrid\n```",
+            '{"rows": [{"country": "France", "capital": "Paris"}]}',
+        ],
+    )
+    item = lib.BatchItem("p", ("country", "capital"), 2, str(tmp_path / "s.csv"))
+
+    [(df, info)] = lib.run_batch([item], sort_by="country")
+    assert "sort the rows A→Z by the 'country'" in batch_calls[0][0]["content"]
+    # the unsorted block is not persisted; the item falls back to run_once
+    assert len(fallback) == 1 and "batch" not in info
+    assert list(df["country"]) == ["France", "Spain"]
+
+    item = lib.BatchItem("p", ("country", "capital"), 1, str(tmp_path / "j.csv"))
+    [(df, _)] = lib.run_batch([item], reply_format="json", use_cache=False)
+    assert len(batch_calls) == 1 and len(fallback) == 2  # JSON items go to run_once
+    assert df.loc[0, "capital"] == "Paris"
+
+
+def test_persist_csv_fast_path_reorders_and_drops(tmp_path):
+    info = {}
+    out = tmp_path / "fast.csv"
+    data = [["b", " a ", "extra"], ["2", "1", "x"]]
+    df = lib._persist(data, ["a", "b"], None, "csv", str(out), {}, info)
+    assert df.to_dict(orient="records") == [{"a": "1", "b": "2"}]
+    assert info["projection"]["dropped"] == ["extra"]
+    with open(out, newline="") as f:
+        assert list(csv.reader(f)) == [["a", "b"], ["1", "2"]]
+
+
+def test_persist_projection_fills_missing_fields(tmp_path):
+    info = {}
+    data = [["a", "extra"], ["1", "x"]]
+    df = lib._persist(data, ["b", "a"], None, "csv", str(tmp_path / "p.csv"), {}, info)
+    assert list(df.columns) == ["b", "a"]
+    assert info["projection"]["kept"] == ["a"]
+    assert info["projection"]["added_empty"] == ["b"]
+    assert info["projection"]["dropped"] == ["extra"]
+
+
+def test_persist_sqlite_fast_path_writes_positional_rows(tmp_path):
+    import sqlite3
+
+    db = tmp_path / "fast.sqlite"
+    data = [["capital", "country"], ["Paris", "France"]]
+    lib._persist(
+        data, ["country", "capital"], None, "sqlite", str(db), {"sqlite_table": "t"}, {}
+    )
+    with sqlite3.connect(db) as con:
+        assert con.execute("SELECT country, capital FROM t").fetchall() == [
+            ("France", "Paris")
+        ]
+
+
+def test_sort_by_reaches_the_system_prompt(tmp_path, cache_dir, monkeypatch):
+    calls = fake_llm(monkeypatch, ["```csv\ncountry,capital\nFrance,Paris\n```"])
+    lib.run_once(
+        "p",
+        ["country", "capital"],
+        1,
+        output=str(tmp_path / "s.csv"),
+        sort_by="capital",
+    )
+    assert "Sort the rows A→Z by the 'capital' column." in calls[0][0]["content"]
+
+
+def test_parse_schema_accepts_list_or_fields_object():
+    assert lib.parse_schema('[" a ", "b", "a"]') == ("a", "b")
+    assert lib.parse_schema(b'{"fields": ["x", 1]}') == ("x", "1")
+    with pytest.raises(ValueError):
+        lib.parse_schema('{"columns": []}')
+    with pytest.raises(ValueError):
+        lib.parse_schema('["x", 1]', strict=True)  # the Gradio app's rule
+
+
+def test_call_llm_replays_complete_replies_from_cache(cache_dir, monkeypatch):
+    from types import SimpleNamespace as NS
+
+    sent = []
+
+    def create(**kw):
+        sent.append(kw)
+        return NS(choices=[NS(finish_reason="stop", message=NS(content="hi"))])
+
+    client = NS(chat=NS(completions=NS(create=create)))
+    monkeypatch.setattr(lib, "_get_client", lambda: client)
+    messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "u"}]
+    assert lib.call_llm(messages) == lib.call_llm(messages) == "hi"
+    assert len(sent) == 1
+    lib.call_llm(messages, use_cache=False)
+    assert len(sent) == 2
+
+
+def fake_stream_client(monkeypatch, text, finish_reason="stop"):
+    """Patch the OpenAI client so each streamed create() yields `text` in one delta."""
+    from contextlib import nullcontext
+    from types import SimpleNamespace as NS
+
+    sent = []
+
+    class _Stream(nullcontext):
+        def __iter__(self):
+            yield NS(choices=[NS(delta=NS(content=text), finish_reason=None)])
+            yield NS(choices=[NS(delta=NS(content=None), finish_reason=finish_reason)])
+
+    def create(**kw):
+        sent.append(kw)
+        return _Stream()
+
+    client = NS(chat=NS(completions=NS(create=create)))
+    monkeypatch.setattr(lib, "_get_client", lambda: client)
+    return sent
+
+
+def test_run_once_streamed_replies_use_the_completion_cache(
+    tmp_path, cache_dir, monkeypatch
+):
+    sent = fake_stream_client(monkeypatch, "```csv\ncountry,capital\nFrance,Paris\n```")
+    # Bypass the result cache so the second run has to go through _collect_reply
+    monkeypatch.setattr(lib, "_read_cached_matrix", lambda key: None)
+    for name in ("a.csv", "b.csv"):
+        df, _ = lib.run_once(
+            "p", ["country", "capital"], 1, output=str(tmp_path / name), use_cache=True
+        )
+        assert df.loc[0, "capital"] == "Paris"
+    assert len(sent) == 1
+
+
+def test_truncated_reply_is_retried_with_a_larger_budget(
+    tmp_path, cache_dir, monkeypatch
+):
+    budgets = []
+
+    def _collect(messages, headers, fmt, max_tokens, **kwargs):
+        budgets.append((max_tokens, len(messages)))
+        if max_tokens < lib.MAX_TOKENS_CAP:
+            kwargs["finish"]["reason"] = "length"
+            return "```csv\ncountry,capital\nFrance,Pa"
+        kwargs["finish"]["reason"] = "stop"
+        return "```csv\ncountry,capital\nFrance,Paris\n```"
+
+    monkeypatch.setattr(lib, "_collect_reply", _collect)
+    monkeypatch.setattr(lib, "_max_tokens_for", lambda *a: lib.MAX_TOKENS_CAP // 4)
+    df, _ = lib.run_once("p", ["country", "capital"], 1, output=str(tmp_path / "t.csv"))
+    cap = lib.MAX_TOKENS_CAP
+    # doubled up to the cap, and resent without a correction turn
+    assert budgets == [(cap // 4, 2), (cap // 2, 2), (cap, 2)]
+    assert df.loc[0, "capital"] == "Paris"
+
+
+def test_speculative_first_attempt_keeps_the_valid_sample(
+    tmp_path, cache_dir, monkeypatch
+):
+    seen = []
+
+    def _collect(
+        messages, headers, fmt, max_tokens, *, temperature, seed, stop, **kwargs
+    ):
+        seen.append((temperature, seed))
+        if seed == 43:
+            return "```csv\ncountry,capital\nFrance,Paris\n```"
+        return "```csv\nwrong\n```"
+
+    monkeypatch.setattr(lib, "_collect_reply", _collect)
+    df, _ = lib.run_once(
+        "p",
+        ["country", "capital"],
+        1,
+        output=str(tmp_path / "sp.csv"),
+        speculative=True,
+    )
+    assert sorted(seen) == [(0, 42), (0.3, 43), (0.3, 44)]
+    assert df.loc[0, "capital"] == "Paris"
+
+
+def test_speculative_winner_does_not_wait_for_slow_losers(
+    tmp_path, cache_dir, monkeypatch
+):
+    import time
+
+    def _collect(
+        messages, headers, fmt, max_tokens, *, temperature, seed, stop, **kwargs
+    ):
+        if seed != 42:
+            time.sleep(1.5)  # e.g. SDK retry backoff before the first delta
+            return "```csv\nwrong\n```"
+        return "```csv\ncountry,capital\nFrance,Paris\n```"
+
+    monkeypatch.setattr(lib, "_collect_reply", _collect)
+    start = time.monotonic()
+    lib.run_once(
+        "p",
+        ["country", "capital"],
+        1,
+        output=str(tmp_path / "sp.csv"),
+        speculative=True,
+    )
+    assert time.monotonic() - start < 1.0
+
+
+def test_call_llm_batch_submits_only_cache_misses(cache_dir, monkeypatch):
+    import json
+    from types import SimpleNamespace as NS
+
+    uploads = []
+    statuses = iter(["in_progress", "completed"])
+
+    def files_create(file, purpose):
+        uploads.append([json.loads(line) for line in file[1].decode().splitlines()])
+        return NS(id="file-in")
+
+    def output():
+        lines = [
+            {
+                "custom_id": "1",
+                "response": {
+                    "body": {
+                        "choices": [
+                            {"finish_reason": "stop", "message": {"content": "two"}}
+                        ]
+                    }
+                },
+            },
+            {"custom_id": "2", "error": {"message": "boom"}},
+        ]
+        return NS(text="\n".join(json.dumps(line) for line in lines))
+
+    client = NS(
+        files=NS(create=files_create, content=lambda file_id: output()),
+        batches=NS(
+            create=lambda **kw: NS(id="b1", status="validating", output_file_id=None),
+            retrieve=lambda job_id: NS(
+                id="b1", status=next(statuses), output_file_id="file-out"
+            ),
+        ),
+    )
+    monkeypatch.setattr(lib, "_get_client", lambda: client)
+    monkeypatch.setattr(lib, "BATCH_POLL_INITIAL", 0)
+
+    msgs = [
+        [{"role": "system", "content": "s"}, {"role": "user", "content": str(i)}]
+        for i in range(3)
+    ]
+    lib._llm_cache().set(
+        lib.LLMCache.key(kind="completion", **lib._completion_body(msgs[0], 100)), "one"
+    )
+
+    assert lib.call_llm_batch(msgs, 100) == ["one", "two", ""]
+    assert [r["custom_id"] for r in uploads[0]] == ["1", "2"]
+    assert lib.call_llm(msgs[1], 100) == "two"  # batch results land in the shared cache
+
+
+def test_call_llm_batch_wraps_client_setup_errors(cache_dir, monkeypatch):
+    def _get_client():
+        raise ValueError("missing OPENAI_API_KEY")
+
+    monkeypatch.setattr(lib, "_get_client", _get_client)
+    msgs = [[{"role": "user", "content": "x"}]]
+    with pytest.raises(RuntimeError, match="OpenAI API error: missing"):
+        lib.call_llm_batch(msgs, 100, use_cache=False)
+
+
+def test_malformed_rate_limit_env_is_ignored(monkeypatch, caplog):
+    monkeypatch.setenv("OPENAI_RPM", "60.5")
+    monkeypatch.setenv("OPENAI_TPM", "90000")
+    assert lib._env_limit("OPENAI_RPM") is None
+    assert "OPENAI_RPM" in caplog.text
+    assert lib._env_limit("OPENAI_TPM") == 90000
+
+
+def test_warmup_is_rate_limited(monkeypatch):
+    from types import SimpleNamespace as NS
+
+    order = []
+    monkeypatch.setattr(lib, "_wait_for_budget", lambda m, t: order.append("budget"))
+
+    def create(**kw):
+        order.append("create")
+
+    client = NS(chat=NS(completions=NS(create=create)))
+    monkeypatch.setattr(lib, "_get_client", lambda: client)
+    lib._warmup()
+    assert order == ["budget", "create"]
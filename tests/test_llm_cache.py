@@ -0,0 +1,17 @@
+from llm_cache import LLMCache
+
+
+def test_key_ignores_argument_order():
+    assert LLMCache.key(a=1, b=[1, 2]) == LLMCache.key(b=[1, 2], a=1)
+    assert LLMCache.key(a=1) != LLMCache.key(a=2)
+
+
+def test_get_set_and_ttl(tmp_path):
+    cache = LLMCache(tmp_path / "c.sqlite")
+    assert cache.get("k") is None
+    cache.set("k", "v1")
+    cache.set("k", "v2")
+    assert cache.get("k") == "v2"
+
+    expired = LLMCache(tmp_path / "c.sqlite", ttl=-1)
+    assert expired.get("k") is None
@@ -0,0 +1,70 @@
+import pytest
+
+from local_datasets import lookup_local
+
+
+def test_eu_capitals_prompt_is_served_locally():
+    data = lookup_local(
+        "List 20 EU countries and their capitals.", ["country", "capital"], 20
+    )
+    assert data[0] == ["country", "capital"]
+    assert len(data) == 21
+    assert data[1] == ["Austria", "Vienna"]
+
+
+def test_column_order_and_sort_follow_request():
+    data = lookup_local(
+        "Give me all the European Union member states and their capitals",
+        ["capital", "country"],
+        2,
+        sort_by="capital",
+    )
+    assert data == [
+        ["capital", "country"],
+        ["Amsterdam", "Netherlands"],
+        ["Athens", "Greece"],
+    ]
+
+
+def test_uncovered_requests_fall_through():
+    cols = ["country", "capital"]
+    assert lookup_local("List 20 countries and their capitals.", cols, 20) is None
+    assert (
+        lookup_local("List EU countries", ["country", "capital", "population"], 5)
+        is None
+    )
+    assert lookup_local("List EU countries", cols, 50) is None
+
+
+@pytest.mark.parametrize(
+    "prompt",
+    [
+        "List 10 capitals of non-EU European countries",
+        "List capitals of EU candidate countries",
+        "List the 5 most populous EU capitals",
+        "EU capitals founded before 1000 AD",
+        "List 5 non-EU countries and their capitals",
+        "list eu countries and their capitals",  # Portuguese "eu", not the EU
+    ],
+)
+def test_prompts_that_change_the_set_go_to_the_llm(prompt):
+    assert lookup_local(prompt, ["country", "capital"], 5) is None
+
+
+def test_count_in_prompt_caps_rows_and_conflicts_fall_through():
+    cols = ["country", "capital"]
+    data = lookup_local("List 3 EU countries and their capitals", cols)
+    assert [r[0] for r in data[1:]] == ["Austria", "Belgium", "Bulgaria"]
+    assert lookup_local("List 3 EU countries and their capitals", cols, 3) == data
+    assert lookup_local("List 3 EU countries and their capitals", cols, 5) is None
+    assert lookup_local("List 30 EU countries and their capitals", cols) is None
+
+
+def test_sort_by_is_case_insensitive(monkeypatch):
+    import local_datasets
+
+    monkeypatch.setattr(
+        local_datasets, "EU_CAPITALS", (("b", "x"), ("A", "y"), ("c", "z"))
+    )
+    data = lookup_local("List EU countries", ["country"], sort_by="country")
+    assert data == [["country"], ["A"], ["b"], ["c"]]
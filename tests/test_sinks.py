@@ -40,6 +40,14 @@ def test_csvsink_write_before_open_raises(tmp_path):
     assert "CsvSink not opened" in str(exc.value)
 
 
+def test_csvsink_append_writes_header_once(tmp_path):
+    out = tmp_path / "out.csv"
+    for value in ("a", "b"):
+        with sinks.CsvSink(str(out), headers=["h"], append=True) as sink:
+            sink.write([{"h": value}])
+    assert read_csv(out) == [["h"], ["a"], ["b"]]
+
+
 def test_sqlite_sink_creates_table_and_inserts_rows(tmp_path):
     db_path = tmp_path / "test.sqlite"
     table = "countries"
@@ -119,6 +127,13 @@ def test_sqlite_upsert_on_iso2(tmp_path):
     con.close()
 
 
+def test_qident_rejects_quotes_on_every_call():
+    assert sinks._qident("iso2") == '"iso2"'
+    for _ in range(2):  # a cached helper must not swallow the error the second time
+        with pytest.raises(ValueError):
+            sinks._qident('bad"name')
+
+
 def test_nullsink_noop(tmp_path):
     s = sinks.NullSink()
     s.open()
@@ -135,6 +150,150 @@ def test_docx_sink_handles_none_as_empty(tmp_path):
         s.write(rows)
 
     from docx import Document
+
     doc = Document(out)
     table = doc.tables[0]
     assert table.cell(1, 1).text == ""  # None -> ""
+
+
+def test_csvsink_write_df_matches_row_writer(tmp_path):
+    import pandas as pd
+
+    out = tmp_path / "df.csv"
+    df = pd.DataFrame([{"colA": "A", "colB": "x, y"}, {"colA": "B", "colB": None}])
+    with sinks.CsvSink(str(out), headers=["colA", "colB", "colC"]) as s:
+        s.write_df(df)
+
+    assert read_csv(out) == [
+        ["colA", "colB", "colC"],
+        ["A", "x, y", ""],
+        ["B", "", ""],
+    ]
+
+
+def test_sqlite_upsert_updates_only_listed_columns(tmp_path):
+    db = tmp_path / "listed.sqlite"
+    cols = ["iso2", "capital", "continent"]
+    with sinks.SqliteSink(
+        str(db), "c", columns=cols, upsert_keys=["iso2"], upsert_update=["capital"]
+    ) as s:
+        s.write([{"iso2": "FR", "capital": "Paris", "continent": "Europe"}])
+        s.write([{"iso2": "FR", "capital": "PARIS", "continent": "EU"}])
+
+    con = sqlite3.connect(db)
+    assert con.execute("SELECT capital, continent FROM c").fetchall() == [
+        ("PARIS", "Europe")
+    ]
+    con.close()
+
+
+def test_positional_rows_for_csv_and_sqlite(tmp_path):
+    rows = [("France", "Paris"), ("Spain", None)]
+
+    out = tmp_path / "t.csv"
+    with sinks.CsvSink(str(out), headers=["country", "capital"]) as s:
+        s.write_rows(rows)
+    assert read_csv(out)[1:] == [["France", "Paris"], ["Spain", ""]]
+
+    db = tmp_path / "t.sqlite"
+    with sinks.SqliteSink(str(db), "c", columns=["country", "capital"]) as s:
+        s.write_rows(rows)
+    con = sqlite3.connect(db)
+    assert con.execute("SELECT * FROM c ORDER BY country").fetchall() == rows
+    con.close()
+
+
+def test_sqlite_write_is_one_transaction_across_batches(tmp_path):
+    db = tmp_path / "tx.sqlite"
+    cols = ["iso2", "capital"]
+    with sinks.SqliteSink(
+        str(db), "c", columns=cols, upsert_keys=["iso2"], batch_size=2
+    ) as s:
+        s.write_rows([("FR", "Paris")])
+        with pytest.raises(sqlite3.Error):
+            # third row breaks the second batch; the first batch must roll back with it
+            s.write_rows([("DE", "Berlin"), ("ES", "Madrid"), ("IT", object())])
+
+    con = sqlite3.connect(db)
+    assert con.execute("SELECT * FROM c").fetchall() == [("FR", "Paris")]
+    con.close()
+
+
+def test_sqlite_session_commits_on_close_and_rolls_back_on_error(tmp_path):
+    db = tmp_path / "session.sqlite"
+    with sinks.SqliteSink(str(db), "c", columns=["iso2"], batch_size=1) as s:
+        s.write_rows([("FR",), ("DE",)])
+        with sqlite3.connect(db) as other:  # nothing visible before close()
+            assert other.execute("SELECT COUNT(*) FROM c").fetchone() == (0,)
+
+    with pytest.raises(RuntimeError):
+        with sinks.SqliteSink(str(db), "c", columns=["iso2"]) as s:
+            s.write_rows([("ES",)])
+            raise RuntimeError("boom")
+
+    con = sqlite3.connect(db)
+    assert con.execute("SELECT iso2 FROM c ORDER BY iso2").fetchall() == [
+        ("DE",),
+        ("FR",),
+    ]
+    con.close()
+
+
+def test_sqlite_tuning_pragmas_are_optional(tmp_path):
+    def pragmas(**kw):
+        s = sinks.SqliteSink(str(tmp_path / "p.sqlite"), "t", columns=["a"], **kw)
+        with s:
+            return [
+                s._conn.execute(f"PRAGMA {p}").fetchone()[0]
+                for p in ("synchronous", "temp_store")
+            ]
+
+    assert pragmas() == [1, 2]  # NORMAL, MEMORY
+    assert pragmas(tuning=False) == [2, 0]  # FULL, DEFAULT
+
+
+def test_shared_sqlite_sinks_reuse_one_connection(tmp_path):
+    db = tmp_path / "shared.sqlite"
+    try:
+        with sinks.SqliteSink(str(db), "countries", columns=["name"], shared=True) as a:
+            a.write([{"name": "France"}])
+            conn = a._conn
+            # opened inside a's session: joins it instead of a second BEGIN
+            with sinks.SqliteSink(
+                str(db), "capitals", columns=["name"], shared=True
+            ) as b:
+                assert b._conn is conn
+                b.write([{"name": "Paris"}])
+        with sinks.SqliteSink(str(db), "meta", columns=["k"], shared=True) as c:
+            assert c._conn is conn
+    finally:
+        sinks.shutdown()
+
+    with sqlite3.connect(db) as check:
+        assert check.execute("SELECT name FROM countries").fetchall() == [("France",)]
+        assert check.execute("SELECT name FROM capitals").fetchall() == [("Paris",)]
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_shared_sinks_used_by_emit_workers_are_closed_with_their_threads(tmp_path):
+    import gc
+
+    import lib
+
+    db = tmp_path / "emit.sqlite"
+    for _ in range(3):  # every emit() call runs its sinks on fresh worker threads
+        status = lib.emit(
+            [{"name": "France"}],
+            [
+                sinks.SqliteSink(str(db), "a", columns=["name"], shared=True),
+                sinks.SqliteSink(str(db), "b", columns=["name"], shared=True),
+            ],
+        )
+        assert "Failure" not in status
+    gc.collect()
+    assert sum(len(p.conns) for p in sinks._POOLS) == 0
+
+    with sqlite3.connect(db) as check:
+        assert check.execute("SELECT COUNT(*) FROM a").fetchone() == (3,)
+        assert check.execute("SELECT COUNT(*) FROM b").fetchone() == (3,)
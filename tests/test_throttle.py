@@ -0,0 +1,40 @@
+from throttle import ThrottledCaller
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, s):
+        self.sleeps.append(s)
+        self.now += s
+
+
+def test_requests_per_minute_paces_after_the_initial_burst():
+    clock = FakeClock()
+    t = ThrottledCaller(rpm=2, clock=clock, sleep=clock.sleep)
+    t.acquire()
+    t.acquire()
+    assert clock.sleeps == []
+    t.acquire()
+    assert clock.sleeps == [30.0]  # one request refills every 60/rpm seconds
+
+
+def test_tokens_per_minute_waits_for_the_missing_tokens():
+    clock = FakeClock()
+    t = ThrottledCaller(tpm=600, clock=clock, sleep=clock.sleep)
+    assert t.run(lambda: "ok", tokens=500) == "ok"
+    t.acquire(tokens=300)  # 100 left, 200 missing at 10 tokens/s
+    assert clock.sleeps == [20.0]
+
+
+def test_unlimited_never_sleeps():
+    clock = FakeClock()
+    t = ThrottledCaller(clock=clock, sleep=clock.sleep)
+    for _ in range(100):
+        t.acquire(tokens=10_000)
+    assert clock.sleeps == []
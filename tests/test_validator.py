@@ -1,3 +1,4 @@
+import pytest
 import validator_csv as validator
 
 
@@ -52,3 +53,89 @@ def test_happy_path_no_errors():
         ],
     )
     assert validator.validate(data, headers=["c1", "c2", "c3"], row_count=3) == []
+
+
+def test_stream_scanner_aborts_on_header_mismatch():
+    scanner = validator.FenceStreamScanner(["c1", "c2"])
+    assert scanner.feed("Sure:\n```cs") is False
+    assert scanner.feed("v\nc1,c3\n") is True
+    assert any("header mismatch" in e for e in scanner.errors)
+
+
+def test_stream_scanner_finds_opener_after_long_chunked_preamble():
+    scanner = validator.FenceStreamScanner(["c1", "c2"])
+    preamble = ["Here is the table you asked for. "] * 500
+    for chunk in [*preamble, "``", "`c", "s", "v\nc1", ",c3\n"]:
+        aborted = scanner.feed(chunk)
+    assert aborted is True
+    assert scanner.errors == [
+        "header mismatch: expected ['c1', 'c2'], got ['c1', 'c3']"
+    ]
+    assert len(scanner._head) < 100  # the preamble is not kept around
+
+
+def test_stream_scanner_keeps_text_when_header_matches():
+    scanner = validator.FenceStreamScanner(["c1", "c2"])
+    chunks = ["```csv\nc1,", "c2\na,b\n", "```"]
+    assert not any(scanner.feed(c) for c in chunks)
+    assert scanner.text == "".join(chunks)
+    assert scanner.errors == []
+
+
+def test_stream_scanner_aborts_on_short_row():
+    scanner = validator.FenceStreamScanner(["c1", "c2"])
+    assert scanner.feed('```csv\nc1,c2\na,"multi\nline"\n') is False
+    assert scanner.feed("b,y\nonly") is False
+    assert scanner.feed("\nnever,read\n") is True
+    assert scanner.errors == ["line 4: expected 2 columns, got 1 (['only'])"]
+
+
+def test_stream_scanner_stops_at_closing_fence():
+    scanner = validator.FenceStreamScanner(["c1", "c2"])
+    assert scanner.feed("```csv\nc1,c2\na,b\n```\nNote: done\n") is False
+    assert scanner.errors == []
+
+
+def test_batch_reply_is_split_by_label():
+    reply = "```csv #2\nc1\nz\n```\n```csv #1\nc1,c2\na,x\n```\n```csv #1\nlate\n```"
+    assert validator.extract_labeled_fences(reply) == {1: "c1,c2\na,x", 2: "c1\nz"}
+
+
+def test_fast_repair_fixes_bom_blank_lines_and_header_whitespace():
+    reply = '```csv\n\ufeff country , capital\nFrance,Paris\n\nSpain,"a\n\nb"\n```'
+    repaired = validator.fast_repair(reply, ["country", "capital"])
+    errs, data = validator.parse_and_validate(repaired, ["country", "capital"], 2)
+    assert errs == []
+    assert data == [["country", "capital"], ["France", "Paris"], ["Spain", "a\n\nb"]]
+
+
+def test_fast_repair_returns_none_when_nothing_to_fix():
+    assert validator.fast_repair("```csv\nc1,c2\na\n```", ["c1", "c2"]) is None
+
+
+@pytest.mark.parametrize("use_regex", [False, True])
+def test_extract_code_fence_is_case_insensitive_and_unicode_safe(use_regex):
+    def extract(t):
+        return validator.extract_code_fence(t, use_regex=use_regex)
+
+    assert extract("İstanbul:\n```CSV\nc1\nx\n```") == "c1\nx"
+    assert extract("```csv\nunterminated") == "```csv\nunterminated"
+
+
+def test_validate_sort_by_reports_order_and_fast_repair_keeps_it():
+    reply = "```csv\nc1,c2\nbeta,1\nAlpha,2\n```"
+    assert validator.parse_and_validate(reply, ["c1", "c2"], 2)[0] == []
+    errs, _ = validator.parse_and_validate(reply, ["c1", "c2"], 2, sort_by="c1")
+    assert errs == ["rows not sorted A→Z by 'c1'"]
+
+    # only the blank line is repaired; the order is the model's to fix
+    assert validator.fast_repair(reply.replace("1\n", "1\n\n"), ["c1", "c2"]) == reply
+    assert validator.fast_repair(reply, ["c1", "c2"]) is None
+
+
+def test_validate_accepts_tuple_headers():
+    data = make_data(["c1", "c2"], [["a", "b"]])
+    assert validator.validate(data, ("c1", "c2"), 1) == []
+    assert validator.validate(data, ("c2", "c1"), 1) == [
+        "header mismatch: expected ['c2', 'c1'], got ['c1', 'c2']"
+    ]
@@ -0,0 +1,24 @@
+from validator_json import parse_and_validate_json
+
+
+def test_rows_become_header_plus_matrix():
+    text = '{"rows": [{"c1": "a", "c2": 1}, {"c1": "b", "c2": null}]}'
+    errs, data = parse_and_validate_json(text, ["c1", "c2"], 2)
+    assert errs == []
+    assert data == [["c1", "c2"], ["a", "1"], ["b", ""]]
+
+
+def test_key_mismatch_is_reported_per_row():
+    text = '{"rows": [{"c1": "a", "c2": "x"}, {"c1": "b", "c3": "y"}]}'
+    errs, _ = parse_and_validate_json(text, ["c1", "c2"], 2)
+    assert len(errs) == 1
+    assert errs[0].startswith("row 2: expected keys")
+
+
+def test_invalid_payloads():
+    assert parse_and_validate_json("not json", ["c1"], 1)[0][0].startswith(
+        "invalid JSON"
+    )
+    assert parse_and_validate_json('{"data": []}', ["c1"], 1)[0] == [
+        'expected an object with a "rows" array'
+    ]
@@ -0,0 +1,71 @@
+"""
+Client-side rate limiting for OpenAI calls.
+
+`ThrottledCaller` keeps two token buckets, requests/minute and tokens/minute,
+refilled continuously. A caller blocks until both budgets allow its request,
+so concurrent workers (run_many, speculative sampling) pace themselves
+instead of tripping 429s and retry storms.
+"""
+
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ThrottledCaller:
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """rpm/tpm of None mean that budget is not limited."""
+        self.rpm = rpm
+        self.tpm = tpm
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # Buckets start full so a burst up to the per-minute budget goes out at once
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._last = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed, self._last = now - self._last, now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until one request of ~`tokens` tokens fits both budgets, then spend it."""
+        if self.tpm:
+            # An oversized request waits for a full bucket
+            tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                need_req = 1 - self._requests if self.rpm else 0
+                need_tok = tokens - self._tokens if self.tpm else 0
+                if need_req <= 0 and need_tok <= 0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+                wait = max(
+                    need_req * 60 / self.rpm if self.rpm else 0,
+                    need_tok * 60 / self.tpm if self.tpm else 0,
+                )
+            # Outside the lock: other threads keep refilling/acquiring
+            self._sleep(wait)
+
+    def run(self, fn: Callable[[], T], tokens: int = 0) -> T:
+        """Call fn() once the budgets allow it."""
+        self.acquire(tokens)
+        return fn()
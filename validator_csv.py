@@ -1,16 +1,94 @@
 import csv
 import io
+import logging
 import sys
 import re
+from itertools import pairwise
 
+logger = logging.getLogger(__name__)
 
-def extract_code_fence(text: str) -> str:
+# Compiled once at import; reused on every reply.
+# Regex form of extract_code_fence's str.find scan, kept for A/B comparison
+_CSV_FENCE = re.compile(r"```csv\s*(.*?)```", flags=re.DOTALL | re.IGNORECASE)
+# Batch replies: one block per sub-request, opened with ```csv #<n>
+_CSV_FENCE_LABELED = re.compile(
+    r"```csv[ \t]*#(\d+)[^\n]*\n(.*?)```", flags=re.DOTALL | re.IGNORECASE
+)
+
+
+def _find_csv_fence(text: str) -> int:
+    """
+    Index just past the first ```csv opener (any case), or -1.
+    Linear str.find scan; only the 3 chars after each ``` are case-folded, so
+    indices stay valid even where lower() would change the string's length.
+    """
+    i = text.find("```")
+    while i >= 0:
+        if text[i + 3 : i + 6].lower() == "csv":
+            return i + 6
+        i = text.find("```", i + 1)
+    return -1
+
+
+def extract_code_fence(text: str, *, use_regex: bool = False) -> str:
     """
     Extracts content from a single ```csv ... ``` block if present.
-    If no fence, returns the original text.
+    If no (closed) fence, returns the original text.
+    use_regex=True matches with the precompiled _CSV_FENCE instead of the
+    str.find scan; both give the same result.
+    """
+    if use_regex:
+        m = _CSV_FENCE.search(text)
+        return m.group(1).strip() if m else text.strip()
+    start = _find_csv_fence(text)
+    if start < 0:
+        return text.strip()
+    end = text.find("```", start)
+    return text[start:end].strip() if end >= 0 else text.strip()
+
+
+def extract_labeled_fences(text: str) -> dict[int, str]:
+    """
+    Extracts the ```csv #<n> ... ``` blocks of a batch reply, keyed by label.
+    The first block wins if a label is repeated.
+    """
+    blocks: dict[int, str] = {}
+    for m in _CSV_FENCE_LABELED.finditer(text):
+        blocks.setdefault(int(m.group(1)), m.group(2).strip())
+    return blocks
+
+
+def _clean_header(cells: list[str]) -> list[str]:
+    """Header names without surrounding whitespace or a stray BOM."""
+    return [c.replace("\ufeff", "").strip() for c in cells]
+
+
+def fast_repair(text: str, headers: list[str]) -> str | None:
+    """
+    Mechanically fix an almost-valid reply so it can be re-validated without
+    another LLM call: strips a BOM, drops blank lines outside quoted fields and
+    trims whitespace around header names (only when that makes them match).
+    Structural fixes only: row order and content are never changed, so a sort
+    violation is left for validate() to report.
+    Returns the repaired reply as a ```csv block, or None if nothing changed.
     """
-    m = re.search(r"```csv\s*(.*?)```", text, flags=re.DOTALL | re.IGNORECASE)
-    return m.group(1).strip() if m else text.strip()
+    inner = extract_code_fence(text).replace("\ufeff", "")
+    lines, in_quotes = [], False
+    for line in inner.splitlines():
+        if line.strip() or in_quotes:
+            lines.append(line)
+        in_quotes ^= line.count('"') % 2 == 1
+    if not lines:
+        return None
+    header = next(csv.reader([lines[0]]), [])
+    if headers and header != list(headers) and _clean_header(header) == list(headers):
+        out = io.StringIO()
+        csv.writer(out, lineterminator="").writerow(headers)
+        lines[0] = out.getvalue()
+    repaired = "\n".join(lines)
+    if repaired == extract_code_fence(text):
+        return None
+    return f"```csv\n{repaired}\n```"
 
 
 def read_csv_strict(csv_text: str):
@@ -19,16 +97,109 @@ def read_csv_strict(csv_text: str):
     return data
 
 
-def validate(data: list[list[str]], headers: list[str], row_count: int) -> list[str]:
+class FenceStreamScanner:
+    """
+    Incrementally scans a streamed LLM reply.
+
+    Chunks are collected as they arrive; as soon as the first line inside the
+    ```csv fence is complete it is checked against the expected header, and
+    every data row after it is checked for width as its line completes, so the
+    caller can abort the stream early instead of paying for the rest of it.
+    The full reply is still validated once the stream ends.
+    """
+
+    def __init__(self, headers: list[str]):
+        self.headers = list(headers)
+        self.errors: list[str] = []
+        self._parts: list[str] = []
+        self._head = ""  # unscanned preamble tail, then the fence body up to the header
+        self._in_fence = False
+        self._header_checked = False
+        self._done = False
+        self._pending = ""  # fenced text not yet split into lines
+        self._record = ""  # lines of a row whose quoted field spans a newline
+        self._line = 1  # same numbering as validate(): data rows start at 2
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> bool:
+        """Append a chunk; return True when the stream should be aborted."""
+        self._parts.append(chunk)
+        if self._done or not self.headers:
+            return False
+        if self._header_checked:
+            self._pending += chunk
+            return self._scan_rows()
+        self._head += chunk
+        if not self._in_fence:
+            start = _find_csv_fence(self._head)
+            if start < 0:
+                # Keep only what could be an opener split across chunks ("```cs" +
+                # "v"), so a long preamble is neither rescanned nor re-copied
+                self._head = self._head[-5:]
+                return False
+            self._head, self._in_fence = self._head[start:], True
+        body = self._head.lstrip()
+        nl = body.find("\n")
+        if nl < 0:
+            return False
+        self._header_checked = True
+        header = next(csv.reader([body[:nl].strip()]), [])
+        # whitespace/BOM around names is left to fast_repair, not worth aborting for
+        if _clean_header(header) != self.headers:
+            self.errors.append(
+                f"header mismatch: expected {self.headers}, got {header}"
+            )
+            self._done = True
+            return True
+        self._pending = body[nl + 1 :]
+        return self._scan_rows()
+
+    def _scan_rows(self) -> bool:
+        """Check each completed data row; stop scanning at the closing fence."""
+        while (nl := self._pending.find("\n")) >= 0:
+            line = self._pending[: nl + 1]
+            self._pending = self._pending[nl + 1 :]
+            if not self._record and line.lstrip().startswith("```"):
+                self._done = True
+                return False
+            self._record += line
+            if self._record.count('"') % 2:
+                continue  # newline inside a quoted field
+            record, self._record = self._record.strip(), ""
+            self._line += 1
+            if not record:
+                continue  # blank lines are left to the full validation
+            row = next(csv.reader([record]), [])
+            if len(row) != len(self.headers):
+                self.errors.append(
+                    f"line {self._line}: expected {len(self.headers)} columns, "
+                    f"got {len(row)} ({row})"
+                )
+                self._done = True
+                return True
+        return False
+
+
+def validate(
+    data: list[list[str]],
+    headers: list[str],
+    row_count: int,
+    sort_by: str | None = None,
+) -> list[str]:
     errs = []
     if not data:
         return ["empty CSV"]
-    header = data[0]
+    # Tuples on both sides: one C-level compare, and list/tuple header specs
+    # (parse_schema returns a tuple) compare equal
+    header, expected = tuple(data[0]), tuple(headers)
     rows = data[1:]
 
     # 1st check
-    if header != headers:
-        errs.append(f"header mismatch: expected {headers}, got {header}")
+    if header != expected:
+        errs.append(f"header mismatch: expected {list(expected)}, got {data[0]}")
 
     # 2nd check
     # if len(rows) != row_count:
@@ -41,14 +212,24 @@ def validate(data: list[list[str]], headers: list[str], row_count: int) -> list[
                 f"line {i}: expected {expected_cols} columns, got {len(row)} ({row})"
             )
 
+    # 3rd check (only with sort_by): one pass, stops at the first inversion
+    if sort_by and sort_by in header:
+        idx = header.index(sort_by)
+        col = [r[idx].casefold() for r in rows if len(r) == expected_cols]
+        if any(a > b for a, b in pairwise(col)):
+            errs.append(f"rows not sorted A→Z by '{sort_by}'")
+
     return errs
 
 
-def parse_and_validate(text: str, headers: list[str], row_count: int):
+def parse_and_validate(
+    text: str, headers: list[str], row_count: int, sort_by: str | None = None
+):
     inner = extract_code_fence(text)
     data = read_csv_strict(inner)
-    errors = validate(data, headers, row_count)
-    print(errors)
+    errors = validate(data, headers, row_count, sort_by)
+    if errors:
+        logger.debug("validation errors: %s", errors)
     return errors, data
 
 
@@ -0,0 +1,37 @@
+try:
+    import orjson as _json  # ~3-5x faster decode than the stdlib
+except ImportError:  # pragma: no cover - optional dependency
+    import json as _json
+
+
+def parse_and_validate_json(text: str, headers: list[str], row_count: int | None):
+    """
+    Validate a JSON-mode reply of the form {"rows": [{col: value, ...}, ...]}.
+
+    Returns (errors, data) where data is the same header + rows matrix that
+    validator_csv.parse_and_validate produces, so downstream steps are shared.
+    """
+    try:
+        obj = _json.loads(text)
+    except ValueError as e:
+        return [f"invalid JSON: {e}"], []
+    rows = obj.get("rows") if isinstance(obj, dict) else None
+    if not isinstance(rows, list):
+        return ['expected an object with a "rows" array'], []
+
+    header = list(headers) or (
+        list(rows[0]) if rows and isinstance(rows[0], dict) else []
+    )
+    expected = set(header)
+    errs = []
+    data = [header]
+    for i, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errs.append(f"row {i}: expected an object, got {type(row).__name__}")
+            continue
+        if set(row) != expected:
+            errs.append(f"row {i}: expected keys {header}, got {list(row)}")
+        data.append(["" if row.get(h) is None else str(row.get(h)) for h in header])
+
+    # row_count is accepted for parity with validator_csv, which does not enforce it either
+    return errs, data